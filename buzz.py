@@ -1,4 +1,9 @@
 #!/usr/bin/env python
+import multiprocessing
+
 from buzzmain.app import *
 
-app.run(port=4024, debug=True)
+if __name__ == '__main__':
+    # Needed by the batch validation process pool in the frozen executable
+    multiprocessing.freeze_support()
+    app.run(port=4024, debug=True)
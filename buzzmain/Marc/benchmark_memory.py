@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Measure the memory taken by decoded records, scaled to 100,000 records.
+
+The records of a MARC file are decoded repeatedly, in turn, and the memory they hold is measured with tracemalloc,
+decoded fully, decoded lazily, and decoded and validated.
+Run with: python -m buzzmain.Marc.benchmark_memory [file] [-n records]"""
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+from buzzmain.Marc.marc_tools import *
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#     Constants
+# ====================
+
+DEFAULT_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'Examples', 'Examples2.lex')
+DEFAULT_RECORDS = 5000
+SCALE_TO = 100000
+
+
+# ====================
+#      Functions
+# ====================
+
+
+def record_data(path):
+    """Function to read the bytes of each record in a MARC file"""
+    with open(path, mode='rb') as f:
+        return [marc + END_OF_RECORD.encode() for marc in f.read().split(END_OF_RECORD.encode()) if marc.strip()]
+
+
+def measure(marcs, n, lazy=False, validate=False):
+    """Function to decode n records, cycling through marcs,
+    and return the memory still allocated once they have been decoded, in MiB"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        records = [Record(marcs[i % len(marcs)], lazy=lazy) for i in range(n)]
+        if validate:
+            for record in records:
+                record.validate()
+        return tracemalloc.get_traced_memory()[0] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('input', nargs='?', default=DEFAULT_FILE, help='MARC file (default Examples/Examples2.lex)')
+    parser.add_argument('-n', '--records', type=int, default=DEFAULT_RECORDS,
+                        help=f'Number of records to decode (default {DEFAULT_RECORDS})')
+    args = parser.parse_args(argv)
+    marcs = record_data(args.input)
+    if not marcs:
+        print('No records found')
+        return 1
+    scale = SCALE_TO / args.records
+    print(f'Memory per {SCALE_TO:,} records (Python {sys.version.split()[0]}):')
+    for label, lazy, validate in [('decoded', False, False), ('decoded lazily', True, False),
+                                  ('decoded and validated', False, True)]:
+        print(f'  {label:<24}{measure(marcs, args.records, lazy, validate) * scale:8.0f} MiB')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,89 @@
+import bisect
+import marshal
+import os
+import re
 import sys
 import unicodedata
+from array import array
 
-from buzzmain.Marc import marc8_mapping
+MULTIBYTE_CHARSET = 0x31
+ASCII_RUN = re.compile(rb'[\x20-\x7e]+')
+# Prebuilt copy of the tables in marc8_mapping; rebuild with python -m buzzmain.Marc.marc8_to_unicode
+MAPPING_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'marc8_mapping.bin')
+
+_TABLES = None
+
+
+class MultibyteTable:
+    """Lookup table for a multibyte character set,
+    held as a sorted array of code points with parallel strings of characters and combining flags"""
+
+    def __init__(self, code_points, chars, flags):
+        self.code_points = code_points
+        self.chars = chars
+        self.flags = flags
+
+    def get(self, code_point):
+        i = bisect.bisect_left(self.code_points, code_point)
+        if i < len(self.code_points) and self.code_points[i] == code_point:
+            return self.chars[i], self.flags[i]
+        return None
+
+
+def compact_tables():
+    """Convert the dictionaries in marc8_mapping to the compact form saved in MAPPING_FILE:
+    for each character set, (code points as little-endian 32-bit integers, characters, combining flags)"""
+    from buzzmain.Marc import marc8_mapping
+    codesets = {}
+    for charset, mapping in marc8_mapping.CODESETS.items():
+        code_points = array('I', sorted(mapping))
+        chars = ''.join(chr(mapping[code_point][0]) for code_point in code_points)
+        flags = bytes(mapping[code_point][1] for code_point in code_points)
+        if sys.byteorder == 'big': code_points.byteswap()
+        codesets[charset] = (code_points.tobytes(), chars, flags)
+    return {'codesets': codesets, 'odd_map': dict(marc8_mapping.ODD_MAP)}
+
+
+def write_mapping_file(path=MAPPING_FILE):
+    with open(path, mode='wb') as f:
+        marshal.dump(compact_tables(), f)
+
+
+def read_mapping_file(path=MAPPING_FILE):
+    """Read the compact tables from MAPPING_FILE, or return None if it is missing or unreadable"""
+    try:
+        with open(path, mode='rb') as f:
+            compact = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(compact, dict) or 'codesets' not in compact or 'odd_map' not in compact:
+        return None
+    return compact
+
+
+def lookup_tables():
+    """Return the MARC-8 mappings as (codesets, odd_map) lookup tables, loading them on first use.
+
+    The tables are read from MAPPING_FILE, falling back to the much slower import of marc8_mapping.
+    Single-byte character sets become lists of 256 entries, indexed by byte, of (character, combining flag)
+    or None; the multibyte EACC set becomes a MultibyteTable"""
+    global _TABLES
+    if _TABLES is None:
+        compact = read_mapping_file() or compact_tables()
+        codesets = {}
+        for charset, (code_points, chars, flags) in compact['codesets'].items():
+            code_points = array('I', code_points)
+            if sys.byteorder == 'big': code_points.byteswap()
+            if charset == MULTIBYTE_CHARSET:
+                codesets[charset] = MultibyteTable(code_points, chars, flags)
+                continue
+            table = [None] * 256
+            for code_point, char, cflag in zip(code_points, chars, flags):
+                table[code_point] = (char, cflag)
+            codesets[charset] = table
+        odd_map = {code_point: chr(uni) for code_point, uni in compact['odd_map'].items()}
+        _TABLES = codesets, odd_map
+    return _TABLES
 
 
 def marc8_to_unicode(marc8, hide_utf8_warnings: bool = False) -> str:
@@ -21,94 +103,103 @@ class MARC8ToUnicode:
 
     def __init__(self, G0: int = basic_latin, G1: int = ansel) -> None:
         self.g0 = G0
-        self.g0_set = {b"(", b",", b"$"}
+        self.g0_set = {0x28, 0x2C, 0x24}
         self.g1 = G1
-        self.g1_set = {b")", b"-", b"$"}
+        self.g1_set = {0x29, 0x2D, 0x24}
 
     def translate(self, marc8_string):
+        """Convert a bytes-like object in MARC-8 to a Unicode string"""
         if not marc8_string:
             return ""
+        codesets, odd_map = lookup_tables()
         uni_list = []
         combinings = []
-        pos = 0
-        while pos < len(marc8_string):
-            if marc8_string[pos : pos + 1] == b"\x1b":
-                next_byte = marc8_string[pos + 1 : pos + 2]
+        pos, length = 0, len(marc8_string)
+        while pos < length:
+            # Runs of printable ASCII in the basic Latin character set map to themselves
+            if self.g0 == self.basic_latin:
+                run = ASCII_RUN.match(marc8_string, pos)
+                if run:
+                    text = run.group().decode("ascii")
+                    pos = run.end()
+                    if len(combinings) > 0:
+                        uni_list.append(text[0])
+                        uni_list.extend(combinings)
+                        combinings = []
+                        text = text[1:]
+                    uni_list.append(text)
+                    continue
+
+            if marc8_string[pos] == 0x1B:
+                next_byte = marc8_string[pos + 1] if pos + 1 < length else None
                 if next_byte in self.g0_set:
-                    if len(marc8_string) >= pos + 3:
-                        if (
-                            marc8_string[pos + 2 : pos + 3] == b","
-                            and next_byte == b"$"
-                        ):
+                    if length >= pos + 3:
+                        if marc8_string[pos + 2] == 0x2C and next_byte == 0x24:
                             pos += 1
-                        self.g0 = ord(marc8_string[pos + 2 : pos + 3])
+                        self.g0 = marc8_string[pos + 2]
                         pos = pos + 3
                         continue
                     else:
-                        uni_list.append(marc8_string[pos : pos + 1].decode("ascii"))
+                        uni_list.append("\x1b")
                         pos += 1
                         continue
 
                 elif next_byte in self.g1_set:
-                    if marc8_string[pos + 2 : pos + 3] == b"-" and next_byte == b"$":
-                        pos += 1
-                    self.g1 = ord(marc8_string[pos + 2 : pos + 3])
+                    self.g1 = marc8_string[pos + 2]
                     pos = pos + 3
                     continue
                 else:
-                    charset = ord(next_byte)
-                    if charset in marc8_mapping.CODESETS:
+                    charset = marc8_string[pos + 1]
+                    if charset in codesets:
                         self.g0 = charset
                         pos += 2
                     elif charset == 0x73:
                         self.g0 = self.basic_latin
                         pos += 2
-                        if pos == len(marc8_string):
+                        if pos == length:
                             break
 
-            def is_multibyte(charset):
-                return charset == 0x31
-
-            mb_flag = is_multibyte(self.g0)
+            mb_flag = self.g0 == MULTIBYTE_CHARSET
 
             if mb_flag:
                 code_point = (
-                    ord(marc8_string[pos : pos + 1]) * 65536
-                    + ord(marc8_string[pos + 1 : pos + 2]) * 256
-                    + ord(marc8_string[pos + 2 : pos + 3])
+                    marc8_string[pos] * 65536
+                    + marc8_string[pos + 1] * 256
+                    + marc8_string[pos + 2]
                 )
                 pos += 3
             else:
-                code_point = ord(marc8_string[pos : pos + 1])
+                code_point = marc8_string[pos]
                 pos += 1
 
             if code_point < 0x20 or 0x80 < code_point < 0xA0:
-                uni = chr(code_point)
                 continue
 
-            try:
-                if code_point > 0x80 and not mb_flag:
-                    (uni, cflag) = marc8_mapping.CODESETS[self.g1][code_point]
-                else:
-                    (uni, cflag) = marc8_mapping.CODESETS[self.g0][code_point]
-            except KeyError:
-                try:
-                    uni = marc8_mapping.ODD_MAP[code_point]
-                    uni_list.append(chr(uni))
+            if mb_flag:
+                entry = codesets[MULTIBYTE_CHARSET].get(code_point)
+            else:
+                table = codesets.get(self.g1 if code_point > 0x80 else self.g0)
+                # A single byte never matches the multibyte set, which is a MultibyteTable rather than a list
+                entry = table[code_point] if isinstance(table, list) else None
+
+            if entry is None:
+                if code_point in odd_map:
+                    uni_list.append(odd_map[code_point])
                     continue
-                except KeyError:
-                    pass
                 sys.stderr.write("Unable to parse character 0x%x in g0=%s g1=%s\n" % (code_point, self.g0, self.g1))
-                uni = ord(" ")
-                cflag = False
+                entry = (" ", 0)
 
-            if cflag:
-                combinings.append(chr(uni))
+            if entry[1]:
+                combinings.append(entry[0])
             else:
-                uni_list.append(chr(uni))
+                uni_list.append(entry[0])
                 if len(combinings) > 0:
                     uni_list.extend(combinings)
                     combinings = []
 
         uni_str = "".join(uni_list)
         return unicodedata.normalize("NFC", uni_str)
+
+
+if __name__ == '__main__':
+    write_mapping_file()
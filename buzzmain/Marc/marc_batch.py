@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+import csv
+import io
+import json
+from concurrent.futures import ProcessPoolExecutor
+from buzzmain.Marc.marc_tools import *
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#     Constants
+# ====================
+
+CHUNK_SIZE = 1000
+REPORT_FORMATS = ['jsonl', 'csv']
+REPORT_COLUMNS = ['record', '001', 'type', 'tag', 'severity', 'message']
+# Markup used to highlight parts of some messages in the web interface, which reports leave out
+MESSAGE_MARKUP = re.compile(r'</?span\b[^>]*>')
+
+
+# ====================
+#       Classes
+# ====================
+
+
+class ValidationReportWriter(object):
+    """Writes validation errors to a text file, one JSON Lines or CSV row per error"""
+
+    def __init__(self, file_handle, report_format='jsonl'):
+        if report_format not in REPORT_FORMATS:
+            raise ValueError(f'Report format must be one of {", ".join(REPORT_FORMATS)}')
+        self.file_handle = file_handle
+        self.report_format = report_format
+        self.rows = 0
+        if report_format == 'csv':
+            self.csv_writer = csv.writer(file_handle)
+            self.csv_writer.writerow(REPORT_COLUMNS)
+
+    def write(self, record_number, record_id, errors):
+        """Write the errors for one record, as returned by Record.validate(); record_number counts from 1"""
+        if not errors: return
+        for error_type in errors:
+            for error in sorted(errors[error_type]):
+                tag, severity, message = error.split('|', 2)
+                message = MESSAGE_MARKUP.sub('', message)
+                row = [record_number, record_id, error_type, tag, severity, message]
+                if self.report_format == 'csv':
+                    self.csv_writer.writerow(row)
+                else:
+                    self.file_handle.write(json.dumps(dict(zip(REPORT_COLUMNS, row)), ensure_ascii=False) + '\n')
+                self.rows += 1
+
+    def flush(self):
+        self.file_handle.flush()
+
+    def close(self):
+        self.file_handle.close()
+
+
+# ====================
+#      Functions
+# ====================
+
+
+def validate_record(marc):
+    """Function to decode and validate a single record.
+    Returns the content of its 001 and its errors (or None if it is valid)"""
+    try:
+        record = Record(marc)
+        valid, errors = record.validate()
+    except Exception as e:
+        return '', {'structure': {f'LDR|Serious|Record cannot be read: {str(e)}'}}
+    return (record['001'].data.strip() if '001' in record else ''), errors
+
+
+def validate_chunk(path, start, end):
+    """Function to validate the records between two byte offsets of a file"""
+    with open(path, mode='rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return [validate_record(marc) for marc in split_records(io.BytesIO(data))]
+
+
+def split_records(file_handle):
+    """Function to read the records in a binary file as bytes, using the record length at the start of each"""
+    while True:
+        first5 = file_handle.read(5)
+        if not first5.strip(): break
+        if len(first5) < 5 or not first5.isdigit(): raise RecordLengthError
+        yield first5 + file_handle.read(int(first5) - 5)
+
+
+def validation_results(file_handle):
+    """Function to validate the records read from a binary file handle one at a time.
+    Yields (record number, 001, errors) in input order, counting records from 0"""
+    for n, marc in enumerate(split_records(file_handle)):
+        record_id, errors = validate_record(marc)
+        yield n, record_id, errors
+
+
+def validate_file(path, workers=None, chunk_size=CHUNK_SIZE, index=None):
+    """Function to validate every record in a file using a pool of processes.
+
+    The file is split into chunks of chunk_size records at the boundaries given by index, its MARCIndex.
+    If index is not given it is built, but not cached, so that no file is written next to the one being validated.
+    Yields (record number, 001, errors) in input order, counting records from 0;
+    errors is None for valid records, or a dictionary of error sets as returned by Record.validate()"""
+    if index is None:
+        with open(path, mode='rb') as f:
+            index = MARCIndex.build(f)
+    offsets = index.offsets
+    starts = list(range(0, len(offsets) - 1, chunk_size))
+    ends = [min(n + chunk_size, len(offsets) - 1) for n in starts]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(validate_chunk, [path] * len(starts),
+                               [offsets[n] for n in starts], [offsets[n] for n in ends])
+        n = 0
+        for chunk in results:
+            for record_id, errors in chunk:
+                yield n, record_id, errors
+                n += 1
+
+
+def write_validation_report(results, report_file, report_format='jsonl'):
+    """Function to write a report from an iterable of (record number, 001, errors),
+    such as validation_results() or validate_file(), without keeping the results in memory.
+    Returns the number of errors written"""
+    writer = ValidationReportWriter(report_file, report_format)
+    for n, record_id, errors in results:
+        writer.write(n + 1, record_id, errors)
+    writer.flush()
+    return writer.rows
@@ -6,9 +6,16 @@
 # ====================
 
 # Import required modules
+import bisect
 import html
+import mmap
+import os
 import re
+import sys
+import tempfile
+import threading
 import unicodedata
+from array import array
 from buzzmain.Marc.marc8_to_unicode import marc8_to_unicode
 from buzzmain.Marc.marc_validation import *
 
@@ -26,6 +33,10 @@ LEADER_LENGTH, DIRECTORY_ENTRY_LENGTH = 24, 12
 SUBFIELD_MARKER, END_OF_FIELD, END_OF_RECORD = chr(0x1F), chr(0x1E), chr(0x1D)
 ALEPH_CONTROL_FIELDS = ['DB ', 'DB', 'SYS', 'FMT', 'SYSID']
 FIELDS_TO_IGNORE = ['CAT', 'LAS']
+INDEX_SUFFIX = '.idx'
+WRITE_BUFFER_SIZE = 1024 * 1024
+# Serialises the decoding of LazyFields, so that a field shared between threads is decoded once
+LAZY_DECODE_LOCK = threading.Lock()
 
 # ====================
 #     Exceptions
@@ -64,6 +75,19 @@ class FieldNotFound(Exception):
     def __str__(self): return "Field not found"
 
 
+class RecordNotFound(Exception):
+    def __str__(self): return "Record number is outside the range of the file"
+
+
+class BreakerLineError(Exception):
+    def __init__(self, line, message):
+        super().__init__(line, message)
+        self.line = line
+        self.message = message
+
+    def __str__(self): return f'Line {self.line}: {self.message}'
+
+
 # ====================
 #       Classes
 # ====================
@@ -71,9 +95,10 @@ class FieldNotFound(Exception):
 
 class MARCReader(object):
 
-    def __init__(self, marc_target):
+    def __init__(self, marc_target, lazy=False):
         if hasattr(marc_target, 'read') and callable(marc_target.read):
             self.file_handle = marc_target
+        self.lazy = lazy
 
     def __iter__(self):
         return self
@@ -86,7 +111,256 @@ class MARCReader(object):
         first5 = self.file_handle.read(5)
         if not first5: raise StopIteration
         if len(first5) < 5: raise RecordLengthError
-        return Record(first5 + self.file_handle.read(int(first5) - 5))
+        return Record(first5 + self.file_handle.read(int(first5) - 5), lazy=self.lazy)
+
+
+class MMapMARCReader(MARCReader):
+    """MARCReader which memory-maps the file and passes each record to the decoder
+    as a memoryview of the mapping, rather than reading it into a new bytes object"""
+
+    def __init__(self, marc_target, lazy=False):
+        super().__init__(marc_target, lazy=lazy)
+        try:
+            self.buffer = mmap.mmap(self.file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            self.buffer = b''
+        self.view = memoryview(self.buffer)
+        self.offset = 0
+
+    def close(self):
+        self.view.release()
+        if isinstance(self.buffer, mmap.mmap):
+            try:
+                self.buffer.close()
+            except BufferError:
+                # Views of the mapping are still in use; it will be unmapped once they are released
+                pass
+        super().close()
+
+    def __next__(self):
+        first5 = self.buffer[self.offset:self.offset + 5]
+        if not first5: raise StopIteration
+        if len(first5) < 5: raise RecordLengthError
+        start, self.offset = self.offset, self.offset + int(first5)
+        return Record(self.view[start:self.offset], lazy=self.lazy)
+
+
+class MARCIndex(object):
+    """Byte offsets of the records in a MARC file.
+
+    offsets[n] is the start of record n; the final entry is the end of the last record,
+    so the length of record n is offsets[n + 1] - offsets[n]."""
+
+    def __init__(self, offsets=None):
+        self.offsets = array('Q', offsets if offsets is not None else [0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def span(self, n):
+        """Return the (offset, length) of record n"""
+        if n < 0: n += len(self)
+        if not 0 <= n < len(self): raise RecordNotFound
+        return self.offsets[n], self.offsets[n + 1] - self.offsets[n]
+
+    @classmethod
+    def build(cls, file_handle):
+        """Index a file in one pass, reading only the record length at the start of each record.
+        A final record cut short by the end of the file is indexed as ending there,
+        so that reading it fails as it does for any other damaged record"""
+        index = cls()
+        pos = 0
+        end = file_handle.seek(0, os.SEEK_END)
+        file_handle.seek(0)
+        while True:
+            first5 = file_handle.read(5)
+            if not first5.strip(): break
+            if len(first5) < 5 or not first5.isdigit(): raise RecordLengthError
+            length = int(first5)
+            if length < LEADER_LENGTH: raise RecordLengthError
+            pos = min(pos + length, end)
+            index.offsets.append(pos)
+            file_handle.seek(pos)
+        return index
+
+    def extend(self, file_handle, end=None):
+        """Index the records after the last one indexed which end before end (by default the end of the file),
+        so that a file can be indexed while it is being written. Returns the number of records added"""
+        if end is None: end = file_handle.seek(0, os.SEEK_END)
+        pos = self.offsets[-1]
+        added = 0
+        while pos + 5 <= end:
+            file_handle.seek(pos)
+            first5 = file_handle.read(5)
+            if not first5.strip(): break
+            if not first5.isdigit(): raise RecordLengthError
+            length = int(first5)
+            if length < LEADER_LENGTH: raise RecordLengthError
+            if pos + length > end: break
+            pos += length
+            self.offsets.append(pos)
+            added += 1
+        return added
+
+    @classmethod
+    def for_file(cls, path):
+        """Load the index cached next to path, building and caching it if missing or out of date"""
+        stat = os.stat(path)
+        index = cls.load(path + INDEX_SUFFIX, stat)
+        if index is None:
+            with open(path, mode='rb') as f:
+                index = cls.build(f)
+            index.save(path + INDEX_SUFFIX, stat)
+        return index
+
+    @classmethod
+    def load(cls, index_path, stat):
+        """Read a cached index, returning None if it is missing, stale or damaged"""
+        header = array('Q')
+        try:
+            with open(index_path, mode='rb') as f:
+                header.fromfile(f, 2)
+                if list(header) != [stat.st_size, stat.st_mtime_ns]:
+                    return None
+                offsets = array('Q')
+                offsets.frombytes(f.read())
+        except (OSError, EOFError, ValueError):
+            # ValueError if the file is not a whole number of offsets long
+            return None
+        if len(offsets) == 0: return None
+        index = cls()
+        index.offsets = offsets
+        return index
+
+    def save(self, index_path, stat):
+        """Cache the index, stamped with the size and modification time of the indexed file.
+        The index is written to a temporary file which then replaces any earlier one,
+        so that an interrupted save never leaves a partial index behind"""
+        try:
+            handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(index_path) or '.', suffix=INDEX_SUFFIX)
+        except OSError:
+            return
+        try:
+            with os.fdopen(handle, mode='wb') as f:
+                array('Q', [stat.st_size, stat.st_mtime_ns]).tofile(f)
+                self.offsets.tofile(f)
+            os.replace(temp_path, index_path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+
+class IndexedMARCReader(MARCReader):
+    """MARCReader with random access to records by number (counting from 0)"""
+
+    def __init__(self, marc_target, index=None, lazy=False):
+        super().__init__(marc_target, lazy=lazy)
+        if index is None:
+            name = getattr(self.file_handle, 'name', None)
+            if isinstance(name, str) and os.path.isfile(name):
+                index = MARCIndex.for_file(name)
+            else:
+                index = MARCIndex.build(self.file_handle)
+        self.index = index
+        self.pos = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, n):
+        offset, length = self.index.span(n)
+        self.file_handle.seek(offset)
+        return Record(self.file_handle.read(length), lazy=self.lazy)
+
+    def __next__(self):
+        if self.pos >= len(self.index): raise StopIteration
+        self.pos += 1
+        return self[self.pos - 1]
+
+    def seek(self, n):
+        """Set the number of the record to be returned by the next call to __next__"""
+        self.pos = n
+
+
+class MARCBreakerReader(object):
+    """Reads records from MARC-breaker text, such as a .mrk file, one record at a time.
+
+    Fields are of the form '=245  10 $aTitle' (the space before the first $ is optional);
+    records are separated by blank lines,
+    or start with a new =LDR line. # or \\ may be used for blanks, and {dollar} for a literal $.
+    If strict is True, a malformed line raises BreakerLineError;
+    otherwise the line is skipped and the error kept in errors"""
+
+    def __init__(self, marc_target, strict=True):
+        if hasattr(marc_target, 'read') and callable(marc_target.read):
+            self.file_handle = marc_target
+        self.strict = strict
+        self.errors = []
+        self.line = 0
+        self.pending = None
+
+    def __iter__(self):
+        return self
+
+    def close(self):
+        if self.file_handle:
+            self.file_handle.close()
+
+    def __next__(self):
+        record, fields = None, []
+        while True:
+            if self.pending is not None:
+                text, self.pending = self.pending, None
+            else:
+                text = self.file_handle.readline()
+                if not text: break
+                self.line += 1
+                text = text.rstrip('\r\n')
+                if self.line == 1: text = text.lstrip('\ufeff')
+            if not text.strip():
+                if record is not None or fields: break
+                continue
+            if text.startswith('=LDR'):
+                if record is not None or fields:
+                    # A new record starts without a blank line before it
+                    self.pending = text
+                    break
+                record = Record()
+                record.leader = text[6:].replace('#', ' ').replace('\\', ' ').replace('^', ' ')
+                continue
+            try:
+                field = self.parse_field(text)
+            except BreakerLineError as e:
+                if self.strict: raise
+                self.errors.append(e)
+                continue
+            if field is not None: fields.append(field)
+        if record is None and not fields: raise StopIteration
+        if record is None: record = Record()
+        record.add_fields(*fields)
+        return record
+
+    def parse_field(self, text):
+        """Parse one line of breaker text as a field, or None for Aleph control fields"""
+        if len(text) < 6 or text[0] != '=' or text[4:6] != '  ':
+            raise BreakerLineError(self.line, f'Field should be of the form =TAG  data: {text}')
+        tag = text[1:4]
+        if tag in ALEPH_CONTROL_FIELDS: return None
+        if tag < '010' and tag.isdigit():
+            return Field(tag=tag, data=text[6:].replace('#', ' ').replace('\\', ' ').replace('{dollar}', '$'))
+        start = 9 if text[8:9] == '$' else 10
+        if len(text) <= start or text[start - 1] != '$':
+            raise BreakerLineError(self.line, f'Field {tag} should have two indicators followed by subfields: {text}')
+        subfields = text[start:].split('$')
+        if '' in subfields:
+            raise BreakerLineError(self.line, f'Empty subfield in field {tag}: {text}')
+        if '{dollar}' in text:
+            subfields = [subfield.replace('{dollar}', '$') for subfield in subfields]
+        subfields = [s for subfield in subfields for s in (subfield[0], subfield[1:])]
+        return Field(tag=tag, indicators=[text[6].replace('\\', ' '), text[7].replace('\\', ' ')], subfields=subfields)
 
 
 class MARCWriter(object):
@@ -100,6 +374,51 @@ class MARCWriter(object):
             raise WriteNeedsRecord
         self.file_handle.write(record.as_marc())
 
+    def write_many(self, records, buffer_size=WRITE_BUFFER_SIZE) -> int:
+        """Write records in batches of at least buffer_size bytes, returning the number of records written"""
+        batch, size, count = [], 0, 0
+        for record in records:
+            if not isinstance(record, Record):
+                raise WriteNeedsRecord
+            marc = record.as_marc()
+            batch.append(marc)
+            size += len(marc)
+            count += 1
+            if size >= buffer_size:
+                self.file_handle.write(b''.join(batch))
+                batch, size = [], 0
+        if batch:
+            self.file_handle.write(b''.join(batch))
+        return count
+
+    def flush(self) -> None:
+        self.file_handle.flush()
+
+    def close(self) -> None:
+        self.file_handle.close()
+
+
+class MARCBreakerWriter(object):
+    """Writes records to a text file as MARC-breaker text, separated by blank lines,
+    in the form read by MARCBreakerReader"""
+
+    def __init__(self, marc_target) -> None:
+        if hasattr(marc_target, 'write') and callable(marc_target.write):
+            self.file_handle = marc_target
+
+    def write(self, record) -> None:
+        if not isinstance(record, Record):
+            raise WriteNeedsRecord
+        self.file_handle.write(record.as_breaker_string() + '\n')
+
+    def write_many(self, records) -> int:
+        """Write records, returning the number of records written"""
+        count = 0
+        for record in records:
+            self.write(record)
+            count += 1
+        return count
+
     def flush(self) -> None:
         self.file_handle.flush()
 
@@ -108,11 +427,18 @@ class MARCWriter(object):
 
 
 class Record(object):
-    def __init__(self, data='', leader=' ' * LEADER_LENGTH, marc8=False):
+    __slots__ = ('leader', 'fields', '_field_keys', '_tag_index', 'pos', 'marc8', 'lazy', 'errors', 'originalFormat')
+
+    def __init__(self, data='', leader=' ' * LEADER_LENGTH, marc8=False, lazy=False):
+        """If lazy is True, the content of each field is only decoded when it is first used.
+        Lazy and fully decoded records alike can be read by several threads at once"""
         self.leader = '{}22{}4500'.format(leader[0:10], leader[12:20])
         self.fields = list()
+        self._field_keys = list()
+        self._tag_index = dict()
         self.pos = 0
         self.marc8 = marc8
+        self.lazy = lazy
         self.errors = None
         self.originalFormat = 'MARC'
         if len(data) > 0:
@@ -143,146 +469,173 @@ class Record(object):
         return self
 
     def __getitem__(self, tag):
-        fields = self.get_fields(tag)
-        if len(fields) > 0: return fields[0]
+        fields = self._tag_index.get(tag)
+        if fields: return fields[0]
         return None
 
     def __contains__(self, tag):
-        fields = self.get_fields(tag)
-        return len(fields) > 0
+        return tag in self._tag_index
 
     def __iter__(self):
-        self.__pos = 0
-        return self
-
-    def __next__(self):
-        if self.__pos >= len(self.fields): raise StopIteration
-        self.__pos += 1
-        return self.fields[self.__pos - 1]
+        # Each iteration has its own iterator, so records can be iterated in nested loops or several threads
+        return iter(self.fields)
 
     def __str__(self):
         text_list = ['=LDR  {}'.format(self.leader)]
         text_list.extend([str(field) for field in self.fields])
         return '\n'.join(text_list) + '\n'
 
+    def as_breaker_string(self):
+        """Returns the record as MARC-breaker text, with any $ in the content of its fields written as {dollar}"""
+        text_list = ['=LDR  {}'.format(self.leader)]
+        text_list.extend([field.as_breaker_string() for field in self.fields])
+        return '\n'.join(text_list) + '\n'
+
+    def as_MRC_string(self):
+        """Returns the record in the Aleph format read by from_MRC_string"""
+        text_list = ['LDR   L {}'.format(self.leader.replace(' ', '^'))]
+        text_list.extend([field.as_MRC_string() for field in self.fields])
+        return '\n'.join(text_list) + '\n'
+
     def get_fields(self, *args):
         if len(args) == 0: return self.fields
-        flds = [f for f in self.fields if f.tag in args]
+        found = [self._tag_index[tag] for tag in set(args) if tag in self._tag_index]
+        if len(found) == 0: flds = []
+        elif len(found) == 1: flds = list(found[0])
+        # Fields with different tags are returned in the order in which they occur in the record
+        else: flds = [f for f in self.fields if f.tag in args]
         if 'LDR' in args:
             flds.append(self.leader)
         return flds
 
     def add_field(self, *fields):
         for fld in fields:
-            if len(self.fields) == 0 or not fld.tag.isdigit():
-                self.fields.append(fld)
-                continue
             self._sort_fields(fld)
 
+    def add_fields(self, *fields):
+        """Add several fields at once, sorting the fields of the record once at the end"""
+        self.fields.extend(fields)
+        self._field_keys.extend(self._sort_key(fld) for fld in fields)
+        for fld in fields:
+            self._tag_index.setdefault(fld.tag, []).append(fld)
+        if len(self._field_keys) > 1:
+            order = sorted(range(len(self.fields)), key=self._field_keys.__getitem__)
+            self.fields = [self.fields[i] for i in order]
+            self._field_keys = [self._field_keys[i] for i in order]
+
     def remove_field(self, *fields):
         for f in fields:
             try:
-                self.fields.remove(f)
+                i = self.fields.index(f)
             except ValueError:
                 raise FieldNotFound
+            del self.fields[i]
+            del self._field_keys[i]
+            self._tag_index[f.tag].remove(f)
+            if not self._tag_index[f.tag]:
+                del self._tag_index[f.tag]
+
+    @staticmethod
+    def _sort_key(field):
+        # Numeric tags are kept in order; other tags (e.g. Aleph's CAT) go at the end
+        if field.tag.isdigit(): return int(field.tag)
+        return float('inf')
 
     def _sort_fields(self, field):
-        tag = int(field.tag)
-        i, last_tag = 0, 0
-        for selff in self.fields:
-            i += 1
-            if not selff.tag.isdigit():
-                self.fields.insert(i - 1, field)
-                break
-
-            last_tag = int(selff.tag)
-
-            if last_tag > tag:
-                self.fields.insert(i - 1, field)
-                break
-            if len(self.fields) == i:
-                self.fields.append(field)
-                break
+        # _field_keys holds the sort key of each field in self.fields, so the insertion point can be found by bisection
+        key = self._sort_key(field)
+        i = bisect.bisect_right(self._field_keys, key)
+        self.fields.insert(i, field)
+        self._field_keys.insert(i, key)
+        # Fields with the same tag are kept together, so appending keeps the index in record order
+        self._tag_index.setdefault(field.tag, []).append(field)
 
     def decode_marc(self, marc):
         # Extract record leader
+        # marc may be bytes or any other bytes-like object, such as a memoryview from MMapMARCReader
         try:
-            self.leader = marc[0:LEADER_LENGTH].decode('ascii')
+            self.leader = str(marc[0:LEADER_LENGTH], 'ascii')
         except:
             print('Record has problem with Leader and cannot be processed')
         if len(self.leader) != LEADER_LENGTH: raise LeaderError
 
         # Extract the byte offset where the record data starts
-        base_address = int(marc[12:17])
+        base_address = int(bytes(marc[12:17]))
         if base_address <= 0: raise BaseAddressError
         if base_address >= len(marc): raise BaseAddressLengthError
 
         # Extract directory
         # base_address-1 is used since the directory ends with an END_OF_FIELD byte
-        directory = marc[LEADER_LENGTH:base_address - 1].decode('ascii')
+        directory = str(marc[LEADER_LENGTH:base_address - 1], 'ascii')
+
+        fields_list = self._locate_fields(marc, base_address, directory)
+        if fields_list is None:
+            fields_list = self._split_fields(marc, base_address, directory)
+        fields = []
+        for tag, field_data in fields_list:
+            if str(tag) in ALEPH_CONTROL_FIELDS:
+                continue
+            if self.lazy:
+                fields.append(LazyField(tag, field_data, marc8=self.marc8))
+            else:
+                fields.append(Field.from_marc(tag, field_data, marc8=self.marc8))
+        self.add_fields(*fields)
 
+        if len(fields) == 0:
+            print('fields error')
+            raise FieldsError
+
+    @staticmethod
+    def _locate_fields(marc, base_address, directory):
+        """Slice the data of each field from the record using the lengths and offsets in the directory.
+        Returns a list of (tag, data) pairs, or None if the directory does not match the record"""
+        if len(directory) % DIRECTORY_ENTRY_LENGTH != 0: return None
+        fields_list = []
+        for i in range(0, len(directory), DIRECTORY_ENTRY_LENGTH):
+            length, offset = directory[i + 3:i + 7], directory[i + 7:i + 12]
+            if not (length.isdigit() and offset.isdigit()): return None
+            start = base_address + int(offset)
+            end = start + int(length) - 1
+            # Each field must end with END_OF_FIELD
+            if int(length) == 0 or end >= len(marc) or marc[end] != 0x1E: return None
+            fields_list.append((directory[i:i + 3], marc[start:end]))
+        return fields_list
+
+    @staticmethod
+    def _split_fields(marc, base_address, directory):
+        """Locate the data of each field by splitting the record on END_OF_FIELD,
+        for records whose directory lengths and offsets cannot be used"""
         field_tags = [directory[i:i+10] for i in range(0, len(directory), 12) ]
-        field_data = marc[base_address:-2].split(b'\x1e')
+        field_data = bytes(marc[base_address:-2]).split(b'\x1e')
         if len(field_tags) != len(field_data):
             print(f'Number of field tags {str(len(field_tags))} does not match number of fields {str(len(field_data))}')
             print(str(field_tags))
             print(str(field_data))
-        fields_list = dict(zip(field_tags, field_data))
-        field_count = 0
-        for tag_key in fields_list:
-            tag = tag_key[:3]
-            if str(tag) < '010' and tag.isdigit():
-                field = Field(tag=tag, data=fields_list[tag_key].decode('utf-8'))
-            elif str(tag) in ALEPH_CONTROL_FIELDS:
-                continue
-            else:
-                subfields = list()
-                subs = fields_list[tag_key].split(b'\x1f')
-                try: subs[0] = subs[0].decode('ascii') + '  '
-                except: subs[0] = '   '
-                first_indicator, second_indicator = subs[0][0], subs[0][1]
-
-                for subfield in subs[1:]:
-                    if len(subfield) == 0: continue
-
-                    try:
-                        code, data = subfield[0:1].decode('ascii'), subfield[1:].decode('utf-8', 'strict')
-                    except:
-                        print('Error in subfield code')
-                    else:
-                        if self.marc8:
-                            data = marc8_to_unicode(data)
-                        subfields.append(code)
-                        subfields.append(html.unescape(data))
-                field = Field(tag=tag, indicators=[first_indicator, second_indicator], subfields=subfields)
-            self.add_field(field)
-            field_count += 1
-
-        if field_count == 0:
-            print('fields error')
-            raise FieldsError
+        return [(tag_key[:3], data) for tag_key, data in dict(zip(field_tags, field_data)).items()]
 
     def as_marc(self):
-        fields, directory = b'', b''
+        # Each field is encoded once; the parts are joined at the end
+        fields, directory = [], []
         offset = 0
 
         for field in self.fields:
             field_data = field.as_marc()
-            fields += field_data
+            fields.append(field_data)
             if field.tag.isdigit():
-                directory += ('%03d' % int(field.tag)).encode('utf-8')
+                directory.append('%03d%04d%05d' % (int(field.tag), len(field_data), offset))
             else:
-                directory += ('%03s' % field.tag).encode('utf-8')
-            directory += ('%04d%05d' % (len(field_data), offset)).encode('utf-8')
+                directory.append('%03s%04d%05d' % (field.tag, len(field_data), offset))
             offset += len(field_data)
 
-        directory += END_OF_FIELD.encode('utf-8')
-        fields += END_OF_RECORD.encode('utf-8')
+        directory.append(END_OF_FIELD)
+        directory = ''.join(directory).encode('utf-8')
+        fields.append(END_OF_RECORD.encode('utf-8'))
         base_address = LEADER_LENGTH + len(directory)
-        record_length = base_address + len(fields)
+        record_length = base_address + offset + 1
         strleader = '%05d%s%05d%s' % (record_length, self.leader[5:12], base_address, self.leader[17:])
         leader = strleader.encode('utf-8')
-        return leader + directory + fields
+        fields[0:0] = [leader, directory]
+        return b''.join(fields)
 
     def validate(self):
 
@@ -293,14 +646,9 @@ class Record(object):
             'abbreviations': set(),
             }
 
-        for field_tag in CONTROL_FIELDS:
-            status, err = CONTROL_FIELDS[field_tag].check_cardinality(self)
-            if not status:
-                self.errors['structure'].add(f'{field_tag}|Serious|{err}')
-        for field_tag in DATA_FIELDS:
-            status, err = DATA_FIELDS[field_tag].check_cardinality(self)
-            if not status:
-                self.errors['structure'].add(f'{field_tag}|Serious|{err}')
+        tag_counts = {tag: len(fields) for tag, fields in self._tag_index.items()}
+        for field_tag, err in CARDINALITY_RULES.check(tag_counts):
+            self.errors['structure'].add(f'{field_tag}|Serious|{err}')
 
         for field in self.fields:
             f_errors = field.validate()
@@ -321,15 +669,14 @@ class Record(object):
                 find = self.get_fields(field_tag)
             if len(find) < 1:
                 self.errors['completeness'].append(f'{field_tag}|Moderate|Desirable field not found.')
-        for abb in ABBREVIATIONS:
-            for field in self:
-                for subfield in field:
-                    if abb.search(subfield[1]):
-                        m = abb.search(subfield[1]).group(0)
-                        self.errors['abbreviations'].append(f'{field.tag}|Ignorable|Abbreviation <span class="fw-bolder">{str(m)}</span> in subfield {subfield[0]} - expand to <span class="fw-bolder">{ABBREVIATIONS[abb]}</span>?')
         '''
+        for tag, code, m, expansion in find_abbreviations(
+                (field.tag, subfield[0], subfield[1]) for field in self.fields for subfield in field):
+            self.errors['abbreviations'].add(f'{tag}|Ignorable|Abbreviation <span class="fw-bolder">{str(m)}</span> in subfield {code} - expand to <span class="fw-bolder">{expansion}</span>?')
         num_errors = sum(len(self.errors[e]) for e in self.errors)
         if num_errors == 0:
+            # Empty sets are not kept, as they take more memory than the record's fields
+            self.errors = None
             return True, None
         return False, self.errors
 
@@ -358,14 +705,15 @@ class Record(object):
 
 
 class Field(object):
+    __slots__ = ('tag', 'data', 'indicators', 'subfields', 'errors')
 
     def __init__(self, tag, indicators=None, subfields=None, data=''):
         if indicators is None: indicators = []
         if subfields is None: subfields = []
         indicators = [str(x) for x in indicators]
 
-        # Normalize tag to three digits
-        self.tag = '%03s' % tag
+        # Normalize tag to three digits; tags are interned, as the same few hundred recur in every record
+        self.tag = sys.intern('%03s' % tag)
 
         # Check if tag is a control field
         if self.tag < '010' and self.tag.isdigit():
@@ -385,9 +733,36 @@ class Field(object):
             self.subfields = subfields
         self.errors = None
 
+    @classmethod
+    def from_marc(cls, tag, marc, marc8=False):
+        """Create a field from the bytes of its data in a MARC record (without the END_OF_FIELD byte)"""
+        if str(tag) < '010' and tag.isdigit():
+            return cls(tag=tag, data=bytes(marc).decode('utf-8'))
+        subfields = list()
+        subs = bytes(marc).split(b'\x1f')
+        try: subs[0] = subs[0].decode('ascii') + '  '
+        except: subs[0] = '   '
+        first_indicator, second_indicator = subs[0][0], subs[0][1]
+
+        for subfield in subs[1:]:
+            if len(subfield) == 0: continue
+
+            try:
+                code = subfield[0:1].decode('ascii')
+                # MARC-8 data is translated from the raw bytes
+                data = marc8_to_unicode(subfield[1:]) if marc8 else subfield[1:].decode('utf-8', 'strict')
+            except:
+                print('Error in subfield code')
+            else:
+                subfields.append(code)
+                subfields.append(html.unescape(data))
+        return cls(tag=tag, indicators=[first_indicator, second_indicator], subfields=subfields)
+
     def __iter__(self):
-        self.__pos = 0
-        return self
+        """Iterate over (code, value) pairs; control fields have no subfields"""
+        subfields = getattr(self, 'subfields', None)
+        if not subfields: return iter(())
+        return zip(subfields[0::2], subfields[1::2])
 
     def __getitem__(self, subfield):
         subfields = self.get_subfields(subfield)
@@ -398,18 +773,14 @@ class Field(object):
         subfields = self.get_subfields(subfield)
         return len(subfields) > 0
 
-    def __next__(self):
-        if not hasattr(self, 'subfields'):
-            raise StopIteration
-        while self.__pos + 1 < len(self.subfields):
-            subfield = (self.subfields[self.__pos], self.subfields[self.__pos + 1])
-            self.__pos += 2
-            return subfield
-        raise StopIteration
-
     def __str__(self):
+        return self.as_breaker_string(dollar='$')
+
+    def as_breaker_string(self, dollar='{dollar}'):
+        """Returns the field as a line of MARC-breaker text, with any $ in its content written as dollar;
+        by default {dollar}, which MARCBreakerReader reads back as $"""
         if self.is_control_field() or self.tag in ALEPH_CONTROL_FIELDS:
-            return '={}  {}'.format(self.tag, self.data.replace(' ', '#'))
+            return '={}  {}'.format(self.tag, self.data.replace(' ', '#').replace('$', dollar))
         text = '={}  '.format(self.tag)
         for indicator in self.indicators:
             if indicator in [' ', '#', '.', '^']:
@@ -418,9 +789,16 @@ class Field(object):
                 text += indicator
         text += ' '
         for subfield in self:
-            text += '${}{}'.format(subfield[0], subfield[1])
+            text += '${}{}'.format(subfield[0], subfield[1].replace('$', dollar))
         return text
 
+    def as_MRC_string(self):
+        """Returns the field in the form '300   L $$axvi, 239 pages ;$$c(12º)'"""
+        if self.is_control_field():
+            return '{}   L {}'.format(self.tag, self.data.replace(' ', '^'))
+        return '{}{}{} L {}'.format(self.tag, self.indicators[0], self.indicators[1],
+                                    ''.join('$${}{}'.format(subfield[0], subfield[1]) for subfield in self))
+
     def text(self, subfields=''):
         if self.is_control_field() or self.tag in ALEPH_CONTROL_FIELDS:
             return self.data.replace(' ', '#')
@@ -443,29 +821,58 @@ class Field(object):
     def as_marc(self):
         if self.is_control_field():
             return (self.data + END_OF_FIELD).encode('utf-8')
-        marc = self.indicators[0] + self.indicators[1]
+        marc = [self.indicators[0], self.indicators[1]]
         for subfield in self:
-            marc += SUBFIELD_MARKER + subfield[0] + subfield[1]
-        return (marc + END_OF_FIELD).encode('utf-8')
+            marc.extend((SUBFIELD_MARKER, subfield[0], subfield[1]))
+        marc.append(END_OF_FIELD)
+        return ''.join(marc).encode('utf-8')
 
     def validate(self):
-        self.errors = {
+        """Returns a dictionary of sets of errors, which is kept as the field's errors if any are found"""
+        errors = {
             'structure': set(),
             'completeness': set(),
             'obsolete coding': set(),
             'abbreviations': set(),
         }
         if self.tag in CONTROL_FIELDS:
-            test, message = CONTROL_FIELDS[self.tag].check_content(self)
-            if not test:
-                self.errors['structure'].add(message)
+            message = check_control_field_content(self.tag, self.data)
+            if message:
+                errors['structure'].add(message)
         elif self.tag in DATA_FIELDS:
-            test, messages = DATA_FIELDS[self.tag].check_indicators(self)
-            if not test:
-                self.errors['structure'].update(messages)
-            test, messages = DATA_FIELDS[self.tag].check_subfields(self)
-            if not test:
-                self.errors['structure'].update(messages)
+            errors['structure'].update(check_data_field_structure(
+                self.tag, tuple(self.indicators), ''.join(subfield[0] for subfield in self)))
         else:
-            self.errors['structure'].add('Field is not valid')
-        return self.errors
+            errors['structure'].add('Field is not valid')
+        self.errors = errors if errors['structure'] else None
+        return errors
+
+
+class LazyField(Field):
+    """Field which keeps the bytes of its data from a MARC record,
+    and only decodes them when its content is first used.
+    Decoding is done under LAZY_DECODE_LOCK, so a LazyField can be shared between threads"""
+    __slots__ = ('_marc', '_marc8')
+
+    def __init__(self, tag, marc, marc8=False):
+        self.tag = sys.intern('%03s' % tag)
+        self.errors = None
+        self._marc = marc
+        self._marc8 = marc8
+
+    def __getattr__(self, name):
+        # Only called for attributes which have not been set, i.e. data, indicators and subfields before decoding
+        if name in ['data', 'indicators', 'subfields']:
+            if self._marc is not None:
+                with LAZY_DECODE_LOCK:
+                    # Another thread may have decoded the field while this one waited for the lock
+                    if self._marc is not None:
+                        # If decoding fails the bytes are kept, so the field raises the same error next time
+                        field = Field.from_marc(self.tag, self._marc, marc8=self._marc8)
+                        for attribute in ['data', 'indicators', 'subfields']:
+                            if hasattr(field, attribute):
+                                setattr(self, attribute, getattr(field, attribute))
+                        self._marc = None
+            # Look again now the field is decoded, by this thread or another, without calling __getattr__
+            return object.__getattribute__(self, name)
+        raise AttributeError(name)
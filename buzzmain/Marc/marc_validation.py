@@ -1,5 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import bisect
+from functools import lru_cache
+
 import regex as re
 
 CARDINALITIES = {
@@ -18,6 +21,8 @@ UNDESIRABLE_FIELDS = {'260': 'Prefer field 264',
                       '720': 'Prefer a controlled field in the 7xx block',
                       '653': 'Prefer a controlled subject term in the 6xx block'}
 
+VALIDATION_CACHE_SIZE = 4096
+
 DESIRABLE_FIELDS = ['1xx', '264', '300', '336', '337', '338']
 
 ABBREVIATIONS = {
@@ -31,6 +36,10 @@ ABBREVIATIONS = {
     re.compile(r'\bmins?\b\.?'): 'minute(s) or miniature',
 }
 
+# All the abbreviations as a single pattern, with a named group for each
+ABBREVIATION_PATTERN = re.compile('|'.join(f'(?P<abbreviation{n}>{abb.pattern})' for n, abb in enumerate(ABBREVIATIONS)))
+ABBREVIATION_EXPANSIONS = {f'abbreviation{n}': expansion for n, expansion in enumerate(ABBREVIATIONS.values())}
+
 
 class GenericField:
 
@@ -41,7 +50,10 @@ class GenericField:
         self.cardinality = cardinality
 
     def check_cardinality(self, rec):
-        count = len(rec.get_fields(self.tag))
+        return self.check_count(len(rec.get_fields(self.tag)))
+
+    def check_count(self, count):
+        """Check the number of times the field occurs in a record against its cardinality"""
         if self.cardinality == '?':
             if count > 1:
                 return False, f'Field is not repeatable, but occurs {str(count)} times'
@@ -69,14 +81,18 @@ class DataField(GenericField):
         super().__init__(tag, cardinality)
         self.indicators = indicators
         self.subfields = re.compile(subfields)
+        self.allowable = re.sub(r'[^a-z0-9]', '', subfields)
 
     def check_indicators(self, field):
+        return self.check_indicator_values(field.indicators[0], field.indicators[1])
+
+    def check_indicator_values(self, indicator1, indicator2):
         test = True
         messages = []
         i1 = self.indicators[0].replace(' ', '#')
         i2 = self.indicators[1].replace(' ', '#')
-        check1 = field.indicators[0].replace(" ", "#")
-        check2 = field.indicators[1].replace(" ", "#")
+        check1 = indicator1.replace(" ", "#")
+        check2 = indicator2.replace(" ", "#")
         if check1 not in i1:
             messages.append(f'Incorrect 1st indicator: {check1} '
                             f'should be {"one of: " if len(i1) > 1 else ""}'
@@ -90,23 +106,19 @@ class DataField(GenericField):
         return test, messages
 
     def check_subfields(self, field):
+        return self.check_subfield_codes(''.join(subfield[0] for subfield in field))
+
+    def check_subfield_codes(self, subfield_codes):
+        """Check a string of the subfield codes in a field, in order"""
         test = True
         messages = []
-        subfield_codes = ''.join(subfield[0] for subfield in field)
         if not self.subfields.match(subfield_codes):
-            allowable = re.sub(r'[^a-z0-9]', '', self.subfields.pattern)
-            for code in set(subfield[0] for subfield in field):
-                if code not in allowable:
+            for code in set(subfield_codes):
+                if code not in self.allowable:
                     messages.append(f'Subfield {code} is not valid for this field')
             test = False
-            if field.tag in SUBFIELDS:
-                for t in SUBFIELDS[field.tag]:
-                    t_test, t_messages = SUBFIELDS[field.tag][t].check_cardinality(field)
-                    if not t_test:
-                        messages.append(t_messages)
-                    t_test, t_messages = SUBFIELDS[field.tag][t].check_order(field)
-                    if not t_test:
-                        messages.extend(t_messages)
+            if self.tag in SUBFIELDS:
+                messages.extend(subfield_order(self.tag).check(subfield_codes))
         return test, messages
 
 
@@ -117,8 +129,11 @@ class ControlField(GenericField):
         self.regex = re.compile(regex)
 
     def check_content(self, field):
-        if not self.regex.match(field.data):
-            return False, f'Incorrect content: \'{str(field.data)}\' should follow pattern \'{self.regex.pattern}\''
+        return self.check_data(field.data)
+
+    def check_data(self, data):
+        if not self.regex.match(data):
+            return False, f'Incorrect content: \'{str(data)}\' should follow pattern \'{self.regex.pattern}\''
         return True, ''
 
 
@@ -163,7 +178,13 @@ class Subfield:
     def check_cardinality(self, field):
         if field.tag != self.tag:
             raise f'Attempted to check {field.tag} against {self.tag} subfield {self.code}'
-        count = len(field.get_subfields(self.code))
+        return self.check_code_count(''.join(subfield[0] for subfield in field))
+
+    def check_code_count(self, subfield_codes):
+        return self.check_count(subfield_codes.count(self.code))
+
+    def check_count(self, count):
+        """Check the number of times the subfield occurs in a field against its cardinality"""
         if self.cardinality == '?':
             if count > 1:
                 return False, f'Subfield {self.code} is not repeatable, but occurs {str(count)} times'
@@ -185,9 +206,12 @@ class Subfield:
         raise f'Invalid cardinality {str(self.cardinality)} for field {self.tag} subfield {self.code}'
 
     def check_order(self, field):
+        return self.check_code_order(''.join(subfield[0] for subfield in field))
+
+    def check_code_order(self, subfield_codes):
         test = True
         messages = []
-        subfield_codes = ['^', ] + [subfield[0] for subfield in field] + ['$', ]
+        subfield_codes = ['^', ] + list(subfield_codes) + ['$', ]
         if self.code not in subfield_codes:
             return False, ''
         for i, code in enumerate(subfield_codes):
@@ -204,6 +228,57 @@ class Subfield:
         return test, messages
 
 
+class SubfieldOrder:
+    """The cardinality and order rules for the subfields of a data field, compiled into a table of transitions.
+
+    transitions maps each pair of adjacent subfield codes, with ^ and $ for the start and end of the field,
+    to the errors for that pair as (number of the subfield rule, message).
+    Codes which are not mentioned in any rule are all treated as None"""
+
+    def __init__(self, subfields):
+        self.subfields = list(subfields.values())
+        self.numbers = {subfield.code: n for n, subfield in enumerate(self.subfields)}
+        self.alphabet = set(self.numbers) | {'^', '$'}
+        for subfield in self.subfields:
+            self.alphabet.update(subfield.before + subfield.after)
+        self.transitions = {}
+        for previous in self.alphabet | {None}:
+            for code in self.alphabet | {None}:
+                errors = []
+                # Messages are in the order Subfield.check_code_order gives them: after, then before
+                if previous in self.numbers and (code is None or code not in self.subfields[self.numbers[previous]].after):
+                    subfield = self.subfields[self.numbers[previous]]
+                    errors.append((self.numbers[previous], f'Subfield {subfield.code} {subfield.after_string().lower()}'))
+                if code in self.numbers and (previous is None or previous not in self.subfields[self.numbers[code]].before):
+                    subfield = self.subfields[self.numbers[code]]
+                    errors.append((self.numbers[code], f'Subfield {subfield.code} {subfield.before_string().lower()}'))
+                if errors:
+                    self.transitions[(previous, code)] = errors
+
+    def check(self, subfield_codes):
+        """Return the cardinality and order errors for a string of subfield codes, in one pass over it.
+        The messages are those of Subfield.check_code_count and Subfield.check_code_order for each rule in turn"""
+        counts = [0] * len(self.subfields)
+        messages = [[] for subfield in self.subfields]
+        previous = '^'
+        for code in list(subfield_codes) + [None]:
+            if code is None:
+                code = '$'
+            else:
+                if code in self.numbers: counts[self.numbers[code]] += 1
+                if code not in self.alphabet: code = None
+            for n, message in self.transitions.get((previous, code), ()):
+                messages[n].append(message)
+            previous = code
+        errors = []
+        for n, subfield in enumerate(self.subfields):
+            test, message = subfield.check_count(counts[n])
+            if not test:
+                errors.append(message)
+            errors.extend(messages[n])
+        return errors
+
+
 CONTROL_FIELDS = {
     '001': ['1', '^[0-9]{9}$'],
     '003': ['1', '^Uk$'],
@@ -642,6 +717,37 @@ for field_tag in DATA_FIELDS:
         print(field_tag)
 
 
+class CardinalityRules:
+    """Field cardinality rules, compiled once so that each record is checked against the counts of its own tags
+    rather than against every entry in CONTROL_FIELDS and DATA_FIELDS"""
+
+    def __init__(self, *field_definitions):
+        # Optional repeatable (*) fields can never fail, so only the other rules are kept
+        self.rules = {}
+        self.mandatory = []
+        for definitions in field_definitions:
+            for tag, rule in definitions.items():
+                if rule.cardinality == '*': continue
+                self.rules[tag] = rule
+                if rule.cardinality in '1+':
+                    self.mandatory.append(rule)
+
+    def check(self, tag_counts):
+        """Yield (tag, message) for each rule broken by a record, given a dictionary of {tag: number of fields}"""
+        for rule in self.mandatory:
+            if tag_counts.get(rule.tag, 0) == 0:
+                yield rule.tag, rule.check_count(0)[1]
+        for tag, count in tag_counts.items():
+            # A field that occurs once cannot break any rule
+            if count < 2 or tag not in self.rules: continue
+            status, message = self.rules[tag].check_count(count)
+            if not status:
+                yield tag, message
+
+
+CARDINALITY_RULES = CardinalityRules(CONTROL_FIELDS, DATA_FIELDS)
+
+
 SUBFIELDS = {
     # ^8*(a(b*|z*)|b+|z+)$
     '010': {
@@ -824,3 +930,66 @@ SUBFIELDS = {
 for field_tag in SUBFIELDS:
     for full_tag in SUBFIELDS[field_tag]:
         SUBFIELDS[field_tag][full_tag] = Subfield(full_tag, *SUBFIELDS[field_tag][full_tag])
+
+
+# ====================
+#  Validation caches
+# ====================
+
+# The same fields (040, 336-338, local 9xx fields, etc.) recur across many records,
+# so the results of checking them are cached
+
+
+@lru_cache(maxsize=VALIDATION_CACHE_SIZE)
+def check_data_field_structure(tag, indicators, subfield_codes):
+    """Return a tuple of the errors in the indicators and subfield codes of a data field"""
+    messages = []
+    test, i_messages = DATA_FIELDS[tag].check_indicator_values(*indicators)
+    messages.extend(i_messages)
+    test, s_messages = DATA_FIELDS[tag].check_subfield_codes(subfield_codes)
+    messages.extend(s_messages)
+    return tuple(messages)
+
+
+@lru_cache(maxsize=VALIDATION_CACHE_SIZE)
+def check_control_field_content(tag, data):
+    """Return the error in the content of a control field, or None"""
+    test, message = CONTROL_FIELDS[tag].check_data(data)
+    if not test:
+        return message
+    return None
+
+
+@lru_cache(maxsize=None)
+def subfield_order(tag):
+    """Return the compiled subfield rules for a data field, compiling them when first needed"""
+    return SubfieldOrder(SUBFIELDS[tag])
+
+
+def validation_cache_info():
+    """Return the hits, misses and sizes of the validation caches"""
+    return {'structure': check_data_field_structure.cache_info(),
+            'content': check_control_field_content.cache_info()}
+
+
+def clear_validation_cache():
+    check_data_field_structure.cache_clear()
+    check_control_field_content.cache_clear()
+
+
+def find_abbreviations(subfields):
+    """Find abbreviations in a sequence of (tag, subfield code, text), searching all the text at once.
+    Yields (tag, subfield code, abbreviation, expansion) for the first occurrence of each abbreviation in each subfield"""
+    subfields = list(subfields)
+    # Subfields are separated by line breaks so that matches cannot span two subfields
+    text = '\n'.join(subfield[2] for subfield in subfields)
+    starts, pos = [], 0
+    for subfield in subfields:
+        starts.append(pos)
+        pos += len(subfield[2]) + 1
+    found = set()
+    for m in ABBREVIATION_PATTERN.finditer(text):
+        n = bisect.bisect_right(starts, m.start()) - 1
+        if (n, m.lastgroup) in found: continue
+        found.add((n, m.lastgroup))
+        yield subfields[n][0], subfields[n][1], m.group(0), ABBREVIATION_EXPANSIONS[m.lastgroup]
@@ -1,12 +1,15 @@
 import os
-import os
+import shutil
 import sys
+import uuid
 
-from flask import Flask, request, redirect, render_template, url_for, send_from_directory
+from flask import Flask, jsonify, request, redirect, render_template, session, url_for, send_from_directory
 from flask_dropzone import Dropzone
 from werkzeug.utils import secure_filename
 
 from buzzmain.Marc.marc_tools import *
+from buzzmain.jobs import *
+from buzzmain.sessions import *
 
 if getattr(sys, 'frozen', False):
     print('Template folder: ' + str(os.path.join(sys._MEIPASS, 'templates')))
@@ -21,7 +24,7 @@ for suffix in ['uploads', 'output']:
 
 app.config['UPLOAD_FOLDER'] = os.path.join(os.getcwd(), 'uploads')
 app.config['OUTPUT_FOLDER'] = os.path.join(os.getcwd(), 'output')
-app.config['DROPZONE_MAX_FILE_SIZE'] = 1024
+app.config['DROPZONE_MAX_FILE_SIZE'] = 16*1024
 app.config['DROPZONE_TIMEOUT'] = 5*60*1000
 app.config['DROPZONE_ALLOWED_FILE_CUSTOM'] = True
 app.config['DROPZONE_ALLOWED_FILE_TYPE'] = '.MRC, .mrc, .lex'
@@ -36,30 +39,34 @@ app.config['DROPZONE_DEFAULT_MESSAGE'] = ('<button class="btn btn-outline-second
                                           '<li><p><small>.mrc</small></p></li>'
                                           '<li><p><small>.lex</p></li></ul>')
 ALLOWED_EXTENSIONS = {'lex', 'mrc', 'MRC'}
+app.config['BUZZ_SESSION_TIMEOUT'] = 60*60
+app.config['BUZZ_RECORD_WINDOW'] = 100
+app.config['BUZZ_PREFETCH'] = 20
+app.config['BUZZ_ERROR_WAIT'] = 2
+app.config['BUZZ_JOB_WORKERS'] = 2
+app.config['BUZZ_JOB_PROCESSES'] = 1
+app.config['BUZZ_UPLOAD_CHUNK_SIZE'] = 8*1024*1024
 app.secret_key = 'secret dino key'
 dropzone = Dropzone(app)
 
 
-class BuzzValues:
+SESSIONS = SessionStore(timeout=app.config['BUZZ_SESSION_TIMEOUT'])
+JOBS = JobManager(workers=app.config['BUZZ_JOB_WORKERS'])
+
 
-    def __init__(self):
-        self.num_input_records = 0
-        self.num_z_records = 0
-        self.pos_input_records = 0
-        self.filename = None
-        self.filetype = 'lex'
-        self.input_records = {1: None}
-        self.z_records = {1: None}
-        self.query = None
-        self.title = None
-        self.au = None
-        self.isbn = None
-        self.writer = MARCWriter
-        self.reader = MARCReader
-        self.blid = None
+def buzz_state():
+    """Function to get the working state for the current user's session"""
+    if 'buzz_id' not in session:
+        session['buzz_id'] = uuid.uuid4().hex
+    return SESSIONS.get(session['buzz_id'])
 
 
-BZ = BuzzValues()
+def session_folder(folder):
+    """Function to get the folder in which the files for the current user's session are kept"""
+    path = os.path.join(app.config[folder], buzz_state().id)
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
 
 
 def allowed_file(fname):
@@ -79,6 +86,7 @@ def favicon():
 @app.route('/home')
 @app.route('/upload', methods=['GET', 'POST'])
 def index():
+    BZ = buzz_state()
     if request.method == 'POST':
         if 'file' not in request.files:
             return render_template('index.html')
@@ -86,16 +94,62 @@ def index():
         if file.filename == '':
             return render_template('index.html')
         if file and allowed_file(file.filename):
+            if 'dzuuid' in request.form:
+                return save_chunk(BZ, file)
+            BZ.close()
             BZ.filename = secure_filename(file.filename)
             if file.filename.rsplit('.', 1)[1] == 'MRC':
                 BZ.filetype = 'MRC'
             else:
                 BZ.filetype = 'lex'
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], BZ.filename))
+            file.save(os.path.join(session_folder('UPLOAD_FOLDER'), BZ.filename))
             return redirect(url_for('read_marc'))
     return render_template('index.html')
 
 
+def save_chunk(BZ, file):
+    """Function to write one chunk of a file uploaded in chunks by Dropzone.
+    Chunks are written in place as they arrive, and the records in them are indexed so that
+    the file can be opened before the upload has finished"""
+    offset = int(request.form.get('dzchunkbyteoffset', 0))
+    total = int(request.form.get('dztotalfilesize', 0))
+    path = os.path.join(session_folder('UPLOAD_FOLDER'), secure_filename(file.filename))
+    if int(request.form.get('dzchunkindex', 0)) == 0:
+        BZ.close()
+        BZ.filename = secure_filename(file.filename)
+        BZ.filetype = 'MRC' if file.filename.rsplit('.', 1)[1] == 'MRC' else 'lex'
+        BZ.upload_index = MARCIndex() if BZ.filetype == 'lex' else None
+        open(path, mode='wb').close()
+    elif secure_filename(file.filename) != BZ.filename or offset > os.path.getsize(path):
+        return jsonify({'error': 'Chunk received out of order'}), 400
+    with open(path, mode='r+b') as f:
+        f.seek(offset)
+        shutil.copyfileobj(file.stream, f)
+        if BZ.upload_index is not None:
+            try:
+                BZ.upload_index.extend(f)
+            except RecordLengthError:
+                # The file will be indexed again, and the error reported, when it is opened
+                BZ.upload_index = None
+    if BZ.prefetcher: BZ.prefetcher.refresh()
+    records = len(BZ.upload_index) if BZ.upload_index is not None else 0
+    if os.path.getsize(path) >= total:
+        if BZ.upload_index is not None:
+            BZ.upload_index.save(path + INDEX_SUFFIX, os.stat(path))
+        BZ.upload_index = None
+    return jsonify({'filename': BZ.filename, 'records': records})
+
+
+@app.route('/upload_status', methods=['GET'])
+def upload_status():
+    """Number of records in the file being uploaded which can be opened so far"""
+    BZ = buzz_state()
+    refresh_count(BZ)
+    uploading = BZ.upload_index is not None
+    return jsonify({'filename': BZ.filename, 'uploading': uploading,
+                    'records': len(BZ.upload_index) if uploading else BZ.num_input_records})
+
+
 @app.route('/help', methods=['GET', 'POST'])
 def buzz_help():
     return render_template('help.html')
@@ -103,40 +157,86 @@ def buzz_help():
 
 @app.route('/uploads/<name>', methods=['GET', 'POST'])
 def download_file(name):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], name)
+    return send_from_directory(session_folder('UPLOAD_FOLDER'), name)
 
 
 @app.route('/read_marc', methods=['GET', 'POST'])
 def read_marc():
+    BZ = buzz_state()
     if not BZ.filename:
-        return redirect(url_for('read_marc'))
-    ifile = open(os.path.join(app.config['UPLOAD_FOLDER'], BZ.filename), encoding='utf-8', mode='r', errors='replace')
-    r = ifile.read()
+        return redirect(url_for('index'))
+    if isinstance(BZ.reader, IndexedMARCReader):
+        # The file has already been opened, perhaps while it was being uploaded
+        refresh_count(BZ)
+        return render_template('process.html', filename=BZ.filename, num_input_records=BZ.num_input_records,
+                               pos_input_records=BZ.pos_input_records, record=BZ.input_records[BZ.pos_input_records])
+    # Close any file already open in this session, keeping the index of a file which is still being uploaded
+    upload_index = BZ.upload_index
+    BZ.close()
+    BZ.upload_index = upload_index
     if BZ.filetype == 'MRC':
-        BZ.input_records[0] = Record().from_MRC_string(r)
+        with open(os.path.join(session_folder('UPLOAD_FOLDER'), BZ.filename), encoding='utf-8', mode='r', errors='replace') as ifile:
+            BZ.input_records = RecordWindow()
+            BZ.input_records[1] = Record().from_MRC_string(ifile.read())
         BZ.num_input_records = 1
     else:
-        with open(os.path.join(app.config['UPLOAD_FOLDER'], BZ.filename), mode='rb') as f:
-            BZ.num_input_records = f.read().count(29)
-        BZ.reader = MARCReader(open(os.path.join(app.config['UPLOAD_FOLDER'], BZ.filename), mode='rb'))
-        BZ.input_records[0] = BZ.reader.__next__()
-    BZ.writer = MARCWriter(open(os.path.join(app.config['OUTPUT_FOLDER'], BZ.filename), mode='wb'))
+        # Records are counted from the offset index, which reads only the length at the start of each record
+        BZ.reader = IndexedMARCReader(open(os.path.join(session_folder('UPLOAD_FOLDER'), BZ.filename), mode='rb'),
+                                      index=BZ.upload_index)
+        BZ.num_input_records = len(BZ.reader)
+        BZ.prefetcher = Prefetcher(os.path.join(session_folder('UPLOAD_FOLDER'), BZ.filename), BZ.reader.index,
+                                   size=app.config['BUZZ_PREFETCH'])
+        BZ.prefetcher.start()
+        BZ.input_records = RecordWindow(BZ.reader, size=app.config['BUZZ_RECORD_WINDOW'], prefetcher=BZ.prefetcher)
+    BZ.writer = MARCWriter(open(os.path.join(session_folder('OUTPUT_FOLDER'), BZ.filename), mode='wb'))
     BZ.pos_input_records = 1
     return render_template('process.html', filename=BZ.filename, num_input_records=BZ.num_input_records,
-                           pos_input_records=1, record=BZ.input_records[0])
+                           pos_input_records=1, record=BZ.input_records[1])
+
+
+def editable_text(record):
+    """Function to get the text of a record as it is shown for editing in marc.html, without CAT and LAS fields"""
+    return '\n'.join(['=LDR  {}'.format(record.leader.replace(' ', '#'))] +
+                     [str(field) for field in record if field.tag not in FIELDS_TO_IGNORE])
+
+
+def refresh_count(BZ):
+    """Function to update the number of records, which grows while a file is being uploaded"""
+    if isinstance(BZ.reader, IndexedMARCReader):
+        BZ.num_input_records = len(BZ.reader)
+
+
+def next_error(BZ, pos):
+    """Function to find the position of the next record after pos with errors, or None if there are none
+    (among the records received so far, if the file is still being uploaded).
+    Raises TimeoutError if the file has not been checked far enough to tell within BUZZ_ERROR_WAIT seconds"""
+    if not BZ.prefetcher:
+        while pos < BZ.num_input_records:
+            pos += 1
+            if not BZ.input_records[pos].validate()[0]: return pos
+        return None
+    while True:
+        found = BZ.prefetcher.next_error(pos, timeout=app.config['BUZZ_ERROR_WAIT'])
+        # The prefetcher validates records as they are in the file, so edited records are checked separately
+        edited = BZ.input_records.next_edited_error(pos)
+        if edited is not None and (found is None or edited <= found): return edited
+        if found not in BZ.input_records.edited: return found
+        pos = found
 
 
 @app.route('/record_number', methods=['GET'])
 def record_number():
+    BZ = buzz_state()
     return str(BZ.pos_input_records)
 
 
 @app.route('/next_record', methods=['GET', 'POST'])
 def next_record():
+    BZ = buzz_state()
+    refresh_count(BZ)
     if request.method == 'POST':
         if BZ.pos_input_records < BZ.num_input_records:
             BZ.pos_input_records += 1
-            BZ.input_records[BZ.pos_input_records] = BZ.reader.__next__()
             return render_template('marc.html',
                                    filename=BZ.filename,
                                    num_input_records=BZ.num_input_records,
@@ -145,19 +245,49 @@ def next_record():
         return render_template('finished.html', filename=BZ.filename)
 
 
+@app.route('/previous_record', methods=['GET', 'POST'])
+def previous_record():
+    BZ = buzz_state()
+    refresh_count(BZ)
+    if request.method == 'POST':
+        if BZ.pos_input_records > 1:
+            BZ.pos_input_records -= 1
+        return render_template('marc.html',
+                               filename=BZ.filename,
+                               num_input_records=BZ.num_input_records,
+                               pos_input_records=BZ.pos_input_records,
+                               record=BZ.input_records[BZ.pos_input_records])
+
+
 @app.route('/download', methods=['GET', 'POST'])
 def download():
+    BZ = buzz_state()
     BZ.writer.flush()
-    print(app.config['OUTPUT_FOLDER'] + BZ.filename)
-    return send_from_directory(directory=app.config['OUTPUT_FOLDER'], path=BZ.filename, mimetype='application/octet-stream', as_attachment=True)
+    print(os.path.join(session_folder('OUTPUT_FOLDER'), BZ.filename))
+    return send_from_directory(directory=session_folder('OUTPUT_FOLDER'), path=BZ.filename, mimetype='application/octet-stream', as_attachment=True)
 
 
 @app.route('/validate', methods=['GET', 'POST'])
 def validate():
+    BZ = buzz_state()
     if request.method == 'POST':
         r = Record()
         r.from_string(request.form.get('editable_marc'))
-        BZ.input_records[BZ.pos_input_records] = r
+        try:
+            record = BZ.input_records[BZ.pos_input_records]
+        except KeyError:
+            record = None
+        if record is not None:
+            # CAT and LAS fields are not shown for editing, so are always those of the record as read
+            r.remove_field(*r.get_fields(*FIELDS_TO_IGNORE))
+            shown = Record()
+            shown.from_string(editable_text(record))
+            if str(r) == str(shown):
+                # The record has only been checked, not changed, so the record as read is kept
+                r = record
+            else:
+                r.add_fields(*record.get_fields(*FIELDS_TO_IGNORE))
+                BZ.input_records[BZ.pos_input_records] = r
         valid, errors = r.validate()
         return render_template('validation.html', valid=valid, errors=errors, pos_input_records=BZ.pos_input_records, num_input_records=BZ.num_input_records)
     return render_template('validation.html', pos_input_records=BZ.pos_input_records, num_input_records=BZ.num_input_records)
@@ -165,18 +295,88 @@ def validate():
 
 @app.route('/next_record_with_errors', methods=['GET', 'POST'])
 def next_record_with_errors():
+    BZ = buzz_state()
+    refresh_count(BZ)
     if request.method == 'POST':
-        while BZ.pos_input_records < BZ.num_input_records:
-            BZ.pos_input_records += 1
-            BZ.input_records[BZ.pos_input_records] = BZ.reader.__next__()
-            valid, errors = BZ.input_records[BZ.pos_input_records].validate()
-            if not valid:
-                return render_template('marc.html',
-                                       filename=BZ.filename,
-                                       num_input_records=BZ.num_input_records,
-                                       pos_input_records=BZ.pos_input_records,
-                                       record=BZ.input_records[BZ.pos_input_records])
-        return render_template('finished.html', filename=BZ.filename)
+        try:
+            pos = next_error(BZ, BZ.pos_input_records)
+        except TimeoutError:
+            # Rather than keep the request waiting, report how far the file has been checked; the page asks again
+            return render_template('scanning.html', filename=BZ.filename, scanned=BZ.prefetcher.scanned,
+                                   num_input_records=BZ.num_input_records)
+        if pos is None and BZ.upload_index is not None:
+            # Records with errors may be in the part of the file still to arrive, so stay where we are
+            return render_template('uploading.html', filename=BZ.filename, num_input_records=BZ.num_input_records)
+        if pos is None:
+            BZ.pos_input_records = BZ.num_input_records
+            return render_template('finished.html', filename=BZ.filename)
+        BZ.pos_input_records = pos
+        return render_template('marc.html',
+                               filename=BZ.filename,
+                               num_input_records=BZ.num_input_records,
+                               pos_input_records=BZ.pos_input_records,
+                               record=BZ.input_records[BZ.pos_input_records])
+
+
+def session_records(BZ):
+    """Function to get all the records in the current file, with any edits made in this session"""
+    if isinstance(BZ.reader, IndexedMARCReader):
+        return file_records(os.path.join(session_folder('UPLOAD_FOLDER'), BZ.filename), dict(BZ.input_records.edited))
+    return iter([BZ.input_records[1]])
+
+
+@app.route('/jobs', methods=['POST'])
+def start_job():
+    """Start a job over the whole of the current file: validate, convert or fix"""
+    BZ = buzz_state()
+    if not BZ.filename or not BZ.num_input_records:
+        return jsonify({'error': 'No file uploaded'}), 400
+    kind = request.form.get('kind')
+    stem = BZ.filename.rsplit('.', 1)[0]
+    if kind == 'validate':
+        if isinstance(BZ.reader, IndexedMARCReader):
+            results = file_results(os.path.join(session_folder('UPLOAD_FOLDER'), BZ.filename),
+                                   dict(BZ.input_records.edited), processes=app.config['BUZZ_JOB_PROCESSES'])
+        else:
+            results = record_results(session_records(BZ))
+        result = f'{stem}_errors.csv'
+        task, args = validate_task, (results, os.path.join(session_folder('OUTPUT_FOLDER'), result))
+    elif kind == 'convert' and request.form.get('format') in ['aleph', 'text']:
+        result = stem + ('.MRC' if request.form.get('format') == 'aleph' else '.mrk')
+        task, args = write_task, (session_records(BZ), os.path.join(session_folder('OUTPUT_FOLDER'), result), request.form.get('format'))
+    elif kind == 'fix':
+        # Write every record, including any edits, as MARC 21
+        result = f'{stem}_fixed.lex'
+        task, args = write_task, (session_records(BZ), os.path.join(session_folder('OUTPUT_FOLDER'), result))
+    else:
+        return jsonify({'error': 'Unknown job'}), 400
+    job = JOBS.submit(Job(kind, task, args, total=BZ.num_input_records, result=result, owner=BZ.id))
+    return jsonify(job.progress()), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_progress(job_id):
+    job = JOBS.get(job_id, owner=buzz_state().id)
+    if job is None:
+        return jsonify({'error': 'No such job'}), 404
+    return jsonify(job.progress())
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = JOBS.get(job_id, owner=buzz_state().id)
+    if job is None:
+        return jsonify({'error': 'No such job'}), 404
+    job.cancel()
+    return jsonify(job.progress())
+
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = JOBS.get(job_id, owner=buzz_state().id)
+    if job is None or job.status != 'finished':
+        return jsonify({'error': 'No result for this job'}), 404
+    return send_from_directory(directory=session_folder('OUTPUT_FOLDER'), path=job.result, mimetype='application/octet-stream', as_attachment=True)
 
 
 if __name__ == "__main__":
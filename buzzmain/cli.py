@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Command-line batch tools for BUZZ, for use without the web interface.
+
+Files are read and written as streams, so '-' may be used for stdin or stdout.
+Formats are taken from file extensions where not given:
+.lex and .mrc are MARC 21 (marc), .MRC is Aleph sequential text (aleph),
+and .mrk and .txt are MARC-breaker text (text)."""
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+import argparse
+import io
+import os
+import sys
+from buzzmain.Marc.marc_batch import *
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#     Constants
+# ====================
+
+FORMATS = ['marc', 'aleph', 'text']
+EXTENSIONS = {'lex': 'marc', 'mrc': 'marc', 'MRC': 'aleph', 'mrk': 'text', 'txt': 'text'}
+# Errors raised by reading a malformed file; ValueError comes from a record length which is not a number
+READ_ERRORS = (BreakerLineError, RecordLengthError, LeaderError, DirectoryError, FieldsError,
+               BaseAddressLengthError, BaseAddressError, ValueError)
+
+
+# ====================
+#      Functions
+# ====================
+
+
+def file_format(fname, fmt=None):
+    """Function to get the format of a file, from the format given or from its extension"""
+    if fmt: return fmt
+    if '.' in fname and fname.rsplit('.', 1)[1] in EXTENSIONS:
+        return EXTENSIONS[fname.rsplit('.', 1)[1]]
+    if '.' in fname and fname.rsplit('.', 1)[1].lower() in EXTENSIONS:
+        return EXTENSIONS[fname.rsplit('.', 1)[1].lower()]
+    return 'marc'
+
+
+def open_input(fname, binary=True):
+    if fname == '-':
+        return sys.stdin.buffer if binary else io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', errors='replace')
+    if binary: return open(fname, mode='rb')
+    return open(fname, mode='r', encoding='utf-8', errors='replace')
+
+
+def open_output(fname, binary=True):
+    if fname == '-':
+        return sys.stdout.buffer if binary else io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', newline='')
+    if binary: return open(fname, mode='wb')
+    return open(fname, mode='w', encoding='utf-8', newline='')
+
+
+def aleph_records(file_handle):
+    """Function to read records from an Aleph text file in which records are separated by blank lines"""
+    lines = []
+    for line in file_handle:
+        if line.strip():
+            lines.append(line)
+            continue
+        if lines:
+            yield Record().from_MRC_string(''.join(lines))
+            lines = []
+    if lines:
+        yield Record().from_MRC_string(''.join(lines))
+
+
+def breaker_records(file_handle, strict=True):
+    """Function to read records from MARC-breaker text.
+    If strict is False, malformed lines are skipped and reported on stderr"""
+    reader = MARCBreakerReader(file_handle, strict=strict)
+    for record in reader:
+        for error in reader.errors:
+            print(f'Skipped {error}', file=sys.stderr)
+        reader.errors.clear()
+        yield record
+
+
+def read_records(fname, fmt, lazy=False, strict=True):
+    """Function to read the records in a file of any of the supported formats"""
+    if fmt == 'marc':
+        return MARCReader(open_input(fname), lazy=lazy)
+    if fmt == 'text':
+        return breaker_records(open_input(fname, binary=False), strict=strict)
+    return aleph_records(open_input(fname, binary=False))
+
+
+def validate(args):
+    output = open_output(args.output, binary=False)
+    if args.workers > 1 and args.input != '-' and file_format(args.input, args.input_format) == 'marc':
+        results = validate_file(args.input, workers=args.workers)
+    elif file_format(args.input, args.input_format) == 'marc':
+        results = validation_results(open_input(args.input))
+    else:
+        results = ((n, (record['001'].data.strip() if '001' in record else ''), record.validate()[1])
+                   for n, record in enumerate(read_records(args.input, file_format(args.input, args.input_format),
+                                                           strict=not args.lenient)))
+    errors = write_validation_report(results, output, args.report_format)
+    output.flush()
+    # Exit status 1 signals that errors were found
+    return 1 if errors > 0 else 0
+
+
+def convert(args):
+    in_format = file_format(args.input, args.input_format)
+    out_format = file_format(args.output, args.output_format)
+    records = read_records(args.input, in_format, strict=not args.lenient)
+    if out_format == 'marc':
+        output = open_output(args.output)
+        MARCWriter(output).write_many(records)
+    elif out_format == 'text':
+        output = open_output(args.output, binary=False)
+        MARCBreakerWriter(output).write_many(records)
+    else:
+        output = open_output(args.output, binary=False)
+        for record in records:
+            output.write(record.as_MRC_string() + '\n')
+    output.flush()
+    return 0
+
+
+def count(args):
+    fmt = file_format(args.input, args.input_format)
+    if fmt != 'marc':
+        print(sum(1 for record in read_records(args.input, fmt, strict=not args.lenient)))
+    elif args.input == '-':
+        print(sum(1 for marc in split_records(sys.stdin.buffer)))
+    else:
+        with open(args.input, mode='rb') as f:
+            print(len(MARCIndex.build(f)))
+    return 0
+
+
+def extract(args):
+    """Write the fields with the given tags, one per line, preceded by the 001 of their record and a tab"""
+    output = open_output(args.output, binary=False)
+    for record in read_records(args.input, file_format(args.input, args.input_format), lazy=True,
+                               strict=not args.lenient):
+        record_id = record['001'].data.strip() if '001' in record else ''
+        for field in record.get_fields(*args.tags):
+            output.write(f'{record_id}\t{field}\n')
+    output.flush()
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='buzz-batch', description=__doc__.split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p = subparsers.add_parser('validate', help='Validate records, writing one line per error')
+    p.add_argument('input', help='Input file, or - for stdin')
+    p.add_argument('-o', '--output', default='-', help='Report file (default stdout)')
+    p.add_argument('-f', '--report-format', choices=REPORT_FORMATS, default='jsonl')
+    p.add_argument('-w', '--workers', type=int, default=1,
+                   help='Number of processes to use for a MARC file (default 1)')
+    p.set_defaults(func=validate)
+
+    p = subparsers.add_parser('convert', help='Convert records between formats')
+    p.add_argument('input', help='Input file, or - for stdin')
+    p.add_argument('output', help='Output file, or - for stdout')
+    p.add_argument('--output-format', choices=FORMATS)
+    p.set_defaults(func=convert)
+
+    p = subparsers.add_parser('count', help='Count records')
+    p.add_argument('input', help='Input file, or - for stdin')
+    p.set_defaults(func=count)
+
+    p = subparsers.add_parser('extract', help='Extract fields by tag')
+    p.add_argument('input', help='Input file, or - for stdin')
+    p.add_argument('-t', '--tag', dest='tags', action='append', required=True, help='Tag to extract (repeatable)')
+    p.add_argument('-o', '--output', default='-', help='Output file (default stdout)')
+    p.set_defaults(func=extract)
+
+    for p in subparsers.choices.values():
+        p.add_argument('--input-format', choices=FORMATS)
+        p.add_argument('--lenient', action='store_true',
+                       help='Skip malformed lines in MARC-breaker input, instead of stopping at the first')
+
+    args = parser.parse_args(argv)
+    try:
+        return args.func(args)
+    except READ_ERRORS as e:
+        print(f'Error reading {args.input}: {e}', file=sys.stderr)
+        return 2
+    except BrokenPipeError:
+        # The output is being read by a command such as head which has stopped reading;
+        # stdout is pointed at devnull so that Python does not report the error again on exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    except OSError as e:
+        print(f'{parser.prog}: {e}', file=sys.stderr)
+        return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
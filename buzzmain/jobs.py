@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from buzzmain.Marc.marc_batch import *
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#     Constants
+# ====================
+
+JOB_WORKERS = 2
+JOB_KEEP = 60 * 60
+JOB_FORMATS = ['marc', 'aleph', 'text']
+
+
+# ====================
+#       Classes
+# ====================
+
+
+class Job(object):
+    """A long-running task over the records of a file.
+
+    task is a generator function, called with args, which yields once for each record it has processed.
+    result is the name of the file the task writes, and total the number of records it will process"""
+
+    def __init__(self, kind, task, args=(), total=0, result=None, owner=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.task = task
+        self.args = args
+        self.total = total
+        self.result = result
+        self.owner = owner
+        self.processed = 0
+        self.status = 'queued'
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.cancelled = False
+
+    def run(self):
+        self.started = time.monotonic()
+        if self.cancelled:
+            self.status = 'cancelled'
+        else:
+            self.status = 'running'
+            try:
+                for _ in self.task(*self.args):
+                    self.processed += 1
+                    if self.cancelled: break
+                self.status = 'cancelled' if self.cancelled else 'finished'
+            except Exception as e:
+                self.status, self.error = 'failed', str(e)
+        self.finished = time.monotonic()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def progress(self):
+        """Return the state of the job, with its rate in records per second and estimated seconds remaining"""
+        elapsed = ((self.finished or time.monotonic()) - self.started) if self.started else 0
+        rate = self.processed / elapsed if elapsed > 0 else 0
+        eta = (self.total - self.processed) / rate if rate and self.status == 'running' else None
+        return {'id': self.id, 'kind': self.kind, 'status': self.status,
+                'processed': self.processed, 'total': self.total,
+                'rate': round(rate, 1), 'eta': round(eta, 1) if eta is not None else None,
+                'error': self.error, 'result': self.result if self.status == 'finished' else None}
+
+
+class JobManager(object):
+    """Runs jobs in a pool of threads, keeping them by ID until JOB_KEEP seconds after they finish"""
+
+    def __init__(self, workers=JOB_WORKERS, keep=JOB_KEEP):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='buzz-job')
+        self.keep = keep
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def submit(self, job):
+        self.prune()
+        with self.lock:
+            self.jobs[job.id] = job
+        self.executor.submit(job.run)
+        return job
+
+    def get(self, job_id, owner=None):
+        """Get a job by ID, or None if there is no such job or it belongs to another owner"""
+        job = self.jobs.get(job_id)
+        if job is None or (owner is not None and job.owner != owner): return None
+        return job
+
+    def prune(self):
+        """Forget jobs which finished more than keep seconds ago"""
+        cutoff = time.monotonic() - self.keep
+        with self.lock:
+            for job_id in [job.id for job in self.jobs.values() if job.finished and job.finished < cutoff]:
+                del self.jobs[job_id]
+
+    def shutdown(self):
+        for job in list(self.jobs.values()):
+            job.cancel()
+        self.executor.shutdown(wait=False)
+
+
+# ====================
+#      Functions
+# ====================
+
+
+def file_records(path, edited=None):
+    """Function to read every record in a MARC file, replacing those in edited,
+    a dictionary of Records keyed by record number counting from 1"""
+    edited = edited or {}
+    with open(path, mode='rb') as f:
+        for n, record in enumerate(MARCReader(f), start=1):
+            yield edited.get(n, record)
+
+
+def record_results(records):
+    """Function to validate records, yielding (record number, 001, errors) as validation_results() does"""
+    for n, record in enumerate(records):
+        valid, errors = record.validate()
+        yield n, (record['001'].data.strip() if '001' in record else ''), errors
+
+
+def file_results(path, edited=None, processes=1):
+    """Function to validate every record in a MARC file, yielding (record number, 001, errors)
+    with the records in edited (keyed by record number counting from 1) validated in place of those in the file"""
+    edited = edited or {}
+    with open(path, mode='rb') as f:
+        if processes > 1:
+            # Uploaded files have their index cached next to them
+            results = validate_file(path, workers=processes, index=MARCIndex.for_file(path))
+        else:
+            results = validation_results(f)
+        for n, record_id, errors in results:
+            if n + 1 in edited:
+                record = edited[n + 1]
+                valid, errors = record.validate()
+                record_id = record['001'].data.strip() if '001' in record else ''
+            yield n, record_id, errors
+
+
+def validate_task(results, path, report_format='csv'):
+    """Task to write a validation report for results such as those yielded by file_results()"""
+    with open(path, mode='w', encoding='utf-8', newline='') as f:
+        writer = ValidationReportWriter(f, report_format)
+        for n, record_id, errors in results:
+            writer.write(n + 1, record_id, errors)
+            yield
+
+
+def write_task(records, path, fmt='marc'):
+    """Task to write records to a file as MARC 21 ('marc'), Aleph sequential ('aleph') or MARC-breaker text ('text')"""
+    if fmt not in JOB_FORMATS:
+        raise ValueError(f'Format must be one of {", ".join(JOB_FORMATS)}')
+    if fmt == 'marc':
+        with open(path, mode='wb') as f:
+            writer = MARCWriter(f)
+            for record in records:
+                writer.write(record)
+                yield
+        return
+    with open(path, mode='w', encoding='utf-8', newline='') as f:
+        writer = MARCBreakerWriter(f) if fmt == 'text' else None
+        for record in records:
+            if writer:
+                writer.write(record)
+            else:
+                f.write(record.as_MRC_string() + '\n')
+            yield
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+import bisect
+import threading
+import time
+from collections import OrderedDict
+
+from buzzmain.Marc.marc_tools import *
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#     Constants
+# ====================
+
+IDLE_TIMEOUT = 60 * 60
+RECORD_WINDOW_SIZE = 100
+PREFETCH_SIZE = 20
+
+
+# ====================
+#       Classes
+# ====================
+
+
+class RecordWindow:
+    """Decoded records for one session, keyed by position in the file counting from 1.
+
+    At most size records read from the file are kept, the least recently used being discarded
+    and read again from the file by offset if they are needed later.
+    Records which have been edited are kept until the window is discarded,
+    with whether they are valid once that has been needed"""
+
+    def __init__(self, reader=None, size=RECORD_WINDOW_SIZE, prefetcher=None):
+        self.reader = reader
+        self.size = size
+        self.prefetcher = prefetcher
+        self.records = OrderedDict()
+        self.edited = {}
+        self.edited_valid = {}
+
+    def __len__(self):
+        return len(self.records) + len(self.edited)
+
+    def __contains__(self, pos):
+        return pos in self.edited or pos in self.records
+
+    def __getitem__(self, pos):
+        if self.prefetcher: self.prefetcher.move_to(pos)
+        if pos in self.edited: return self.edited[pos]
+        if pos in self.records:
+            self.records.move_to_end(pos)
+            return self.records[pos]
+        if self.reader is None: raise KeyError(pos)
+        record = self.prefetcher.get(pos) if self.prefetcher else None
+        if record is None: record = self.reader[pos - 1]
+        self.records[pos] = record
+        if len(self.records) > self.size:
+            self.records.popitem(last=False)
+        return record
+
+    def __setitem__(self, pos, record):
+        self.edited[pos] = record
+        self.edited_valid.pop(pos, None)
+        self.records.pop(pos, None)
+
+    def next_edited_error(self, pos):
+        """Return the position of the first edited record after pos with errors, or None if there are none.
+        Each edited record is validated at most once"""
+        for p in sorted(p for p in self.edited if p > pos):
+            if p not in self.edited_valid:
+                self.edited_valid[p] = self.edited[p].validate()[0]
+            if not self.edited_valid[p]: return p
+        return None
+
+
+class Prefetcher(threading.Thread):
+    """Thread which reads and validates the records of a file ahead of a session's position in it.
+
+    The size records after the current position are kept decoded, with whether they are valid.
+    The rest of the file is validated in order and the positions of records with errors are kept,
+    so that the next record with errors can be found without validating records on the request thread.
+    The thread reads the file through its own file handle. Positions count from 1"""
+
+    def __init__(self, path, index, size=PREFETCH_SIZE):
+        super().__init__(daemon=True)
+        self.reader = IndexedMARCReader(open(path, mode='rb'), index=index)
+        self.size = size
+        self.position = 0
+        self.ahead = {}
+        self.scanned = 0
+        self.errors = []
+        self.stopped = False
+        self.condition = threading.Condition()
+
+    @property
+    def count(self):
+        # The index may still be growing if the file is being uploaded
+        return len(self.reader)
+
+    def refresh(self):
+        """Wake the thread after records have been added to the index"""
+        with self.condition:
+            self.condition.notify_all()
+
+    def move_to(self, pos):
+        """Set the current position, discarding records which are no longer ahead of it"""
+        with self.condition:
+            if pos == self.position: return
+            self.position = pos
+            for p in [p for p in self.ahead if not pos < p <= pos + self.size]:
+                del self.ahead[p]
+            self.condition.notify_all()
+
+    def get(self, pos):
+        """Return the record at pos if it has been read ahead, or None"""
+        with self.condition:
+            record, valid = self.ahead.get(pos, (None, None))
+        return record
+
+    def next_error(self, pos, timeout=None):
+        """Return the position of the first record after pos with errors, or None if there are none.
+        Waits for the thread to reach it if necessary; if timeout is given, for at most timeout seconds,
+        raising TimeoutError if the thread has not reached it by then. If the index is still growing,
+        None means only that there are none among the records indexed so far"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.condition:
+            while True:
+                n = bisect.bisect_right(self.errors, pos)
+                if n < len(self.errors): return self.errors[n]
+                if self.scanned >= self.count or self.stopped: return None
+                if deadline is None:
+                    self.condition.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: raise TimeoutError
+                self.condition.wait(remaining)
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+
+    def next_task(self):
+        """Return the next position to read and whether to keep the record, or None if there is nothing to do.
+        Must be called with the condition held"""
+        for pos in range(self.position + 1, min(self.position + self.size, self.count) + 1):
+            if pos not in self.ahead: return pos, True
+        # Records already read ahead need not be validated again
+        while self.scanned < self.count and self.scanned + 1 in self.ahead:
+            self.scanned += 1
+            if not self.ahead[self.scanned][1]: self.errors.append(self.scanned)
+            self.condition.notify_all()
+        if self.scanned < self.count: return self.scanned + 1, False
+        return None
+
+    def run(self):
+        try:
+            while True:
+                with self.condition:
+                    task = self.next_task()
+                    while task is None and not self.stopped:
+                        self.condition.wait()
+                        task = self.next_task()
+                    if self.stopped: return
+                pos, keep = task
+                try:
+                    record = self.reader[pos - 1]
+                    valid = record.validate()[0]
+                except Exception:
+                    # The record will be read again, and the error raised, on the request thread
+                    record, valid = None, False
+                with self.condition:
+                    if keep and self.position < pos <= self.position + self.size:
+                        self.ahead[pos] = (record, valid)
+                    if pos == self.scanned + 1:
+                        self.scanned = pos
+                        if not valid: self.errors.append(pos)
+                    self.condition.notify_all()
+        finally:
+            self.reader.close()
+
+
+class BuzzValues:
+    """Working state for one user's session"""
+
+    def __init__(self, session_id=None):
+        self.id = session_id
+        self.num_input_records = 0
+        self.num_z_records = 0
+        self.pos_input_records = 0
+        self.filename = None
+        self.filetype = 'lex'
+        self.input_records = RecordWindow()
+        self.z_records = {1: None}
+        self.query = None
+        self.title = None
+        self.au = None
+        self.isbn = None
+        self.writer = MARCWriter
+        self.reader = MARCReader
+        self.prefetcher = None
+        self.upload_index = None
+        self.blid = None
+
+    def close(self):
+        """Close the files opened by the session's reader and writer, stop reading ahead,
+        and forget the index of any file being uploaded"""
+        if self.prefetcher:
+            self.prefetcher.stop()
+            self.prefetcher = None
+        for marc_io in [self.reader, self.writer]:
+            # Until a file has been opened, reader and writer are the classes rather than instances
+            if isinstance(marc_io, (MARCReader, MARCWriter)) and getattr(marc_io, 'file_handle', None):
+                try:
+                    marc_io.close()
+                except (OSError, ValueError):
+                    pass
+        self.reader, self.writer = MARCReader, MARCWriter
+        self.input_records = RecordWindow()
+        self.upload_index = None
+
+
+class SessionStore:
+    """BuzzValues for each session, keyed by session ID.
+    Sessions which have not been used for timeout seconds are removed and their files closed"""
+
+    def __init__(self, timeout=IDLE_TIMEOUT):
+        self.timeout = timeout
+        self.states = {}
+        self.last_used = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.states)
+
+    def __contains__(self, session_id):
+        return session_id in self.states
+
+    def get(self, session_id):
+        """Get the state for a session, creating it if necessary"""
+        self.evict_idle()
+        with self.lock:
+            if session_id not in self.states:
+                self.states[session_id] = BuzzValues(session_id)
+            self.last_used[session_id] = time.monotonic()
+            return self.states[session_id]
+
+    def remove(self, session_id):
+        with self.lock:
+            state = self.states.pop(session_id, None)
+            self.last_used.pop(session_id, None)
+        if state: state.close()
+
+    def evict_idle(self):
+        """Remove sessions which have been idle for longer than the timeout"""
+        cutoff = time.monotonic() - self.timeout
+        with self.lock:
+            idle = [session_id for session_id, last_used in self.last_used.items() if last_used < cutoff]
+            states = [self.states.pop(session_id) for session_id in idle]
+            for session_id in idle:
+                del self.last_used[session_id]
+        for state in states:
+            state.close()
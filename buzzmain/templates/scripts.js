@@ -91,7 +91,11 @@ async function checkRecord() {
 /* Functions for record navigation */
 
 
+// Timer for asking again for the next record with errors, while the file is still being checked
+var errorPoll = null;
+
 async function nextRecord() {
+    clearTimeout(errorPoll);
     let data = new FormData();
     data.append('action',  'next');
     var resp = await fetch('next_record', {
@@ -111,7 +115,23 @@ async function nextRecord() {
     };
 }
 
+async function previousRecord() {
+    clearTimeout(errorPoll);
+    let data = new FormData();
+    data.append('action',  'previous');
+    var resp = await fetch('previous_record', {
+        'method': 'POST',
+        'body': data,
+    });
+    var ht = await resp.text()
+    $('#marc').html($(ht));
+    setupToggle();
+    setupHighlighter();
+    checkRecord();
+}
+
 async function nextRecordWithErrors() {
+    clearTimeout(errorPoll);
     let data = new FormData();
     data.append('action',  'next');
     var resp = await fetch('next_record_with_errors', {
@@ -119,7 +139,14 @@ async function nextRecordWithErrors() {
         'body': data,
     });
     var ht = await resp.text()
-    if (ht.startsWith('<p>End of file')) {
+    if (ht.startsWith('<p>Still scanning')) {
+        // Keep the current record and ask again, showing how far the file has been checked
+        $('#validate').html($(ht));
+        errorPoll = setTimeout(nextRecordWithErrors, 1000);
+    } else if (ht.startsWith('<p>Still uploading')) {
+        // Keep the current record, as records with errors may still arrive
+        $('#validate').html($(ht));
+    } else if (ht.startsWith('<p>End of file')) {
         console.log('EOF');
         $('#validate').html("");
         $('#marc').html($(ht));
@@ -131,4 +158,52 @@ async function nextRecordWithErrors() {
     };
 }
 
-/* END Functions for record navigation */
\ No newline at end of file
+/* END Functions for record navigation */
+
+/* Functions for whole-file jobs */
+
+
+async function startJob(kind, format) {
+    let data = new FormData();
+    data.append('kind', kind);
+    if (format) {
+        data.append('format', format);
+    }
+    var resp = await fetch('jobs', {
+        'method': 'POST',
+        'body': data,
+    });
+    var job = await resp.json();
+    if (!resp.ok) {
+        $('#job_status').text(job.error);
+        return;
+    }
+    pollJob(job.id);
+}
+
+async function pollJob(id) {
+    var resp = await fetch('jobs/' + id);
+    var job = await resp.json();
+    if (job.status == 'finished') {
+        $('#job_status').html('<a href="jobs/' + id + '/result"><i class="bi bi-download"></i>Download ' + job.result + '</a>');
+    } else if (job.status == 'failed') {
+        $('#job_status').text('Failed: ' + job.error);
+    } else if (job.status == 'cancelled') {
+        $('#job_status').text('Cancelled');
+    } else if (!resp.ok) {
+        $('#job_status').text(job.error);
+    } else {
+        var text = job.processed + ' of ' + job.total + ' records';
+        if (job.rate) {
+            text += ' (' + Math.round(job.rate) + ' per second';
+            if (job.eta != null) {
+                text += ', about ' + Math.ceil(job.eta) + ' seconds left';
+            }
+            text += ')';
+        }
+        $('#job_status').text(text);
+        setTimeout(() => pollJob(id), 1000);
+    }
+}
+
+/* END Functions for whole-file jobs */
@@ -1,4 +1,4 @@
-python -m PyInstaller buzz.py -F --paths "venv/Lib/site-packages" --add-data "buzzmain/templates;templates" --add-data "buzzmain/static;static" --icon=buzzmain/static/favicon.ico --clean
+python -m PyInstaller buzz.py -F --paths "venv/Lib/site-packages" --add-data "buzzmain/templates;templates" --add-data "buzzmain/static;static" --add-data "buzzmain/Marc/marc8_mapping.bin;buzzmain/Marc" --icon=buzzmain/static/favicon.ico --clean
 read -p "Press [Enter]"
 mv dist/buzz.exe buzz.exe
 rm -rfd dist
@@ -16,6 +16,8 @@ setup(name='buzz',
       long_description=
       '''Tools for checking and amending records in MARC21 format''',
       packages=find_packages(),
+      package_data={'buzzmain.Marc': ['marc8_mapping.bin']},
+      entry_points={'console_scripts': ['buzz-batch=buzzmain.cli:main']},
       platforms=['any'],
       classifiers=[
           'Development Status :: 4 - Beta',